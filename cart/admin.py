@@ -1,3 +1,20 @@
 from django.contrib import admin
+from .models import UserCart, UserCartItem
 
-# Register your models here.
+class UserCartItemInline(admin.TabularInline):
+    model = UserCartItem
+    raw_id_fields = ['product']
+    readonly_fields = ['added']
+    extra = 0
+
+@admin.register(UserCart)
+class UserCartAdmin(admin.ModelAdmin):
+    list_display = ['user', 'item_count', 'total_price', 'updated']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['item_count', 'total_price', 'updated']
+    inlines = [UserCartItemInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_totals()
@@ -1,6 +1,71 @@
 from decimal import Decimal
 from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from products.models import Product
+from .models import UserCart, UserCartItem
+
+
+def to_cents(price):
+    """
+    Convert a price (Decimal or string) to integer cents.
+    """
+    return int(Decimal(price).scaleb(2).to_integral_value())
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def _stored_cents(price):
+    # Carts saved before prices were stored in cents hold strings like '9.99'
+    return price if isinstance(price, int) else to_cents(price)
+
+
+class CartLine:
+    """
+    One product in the cart, as shown on the cart and checkout pages.
+    """
+    __slots__ = ('product', 'quantity', 'price_cents', 'update_quantity_form')
+
+    def __init__(self, product, quantity, price_cents):
+        self.product = product
+        self.quantity = quantity
+        self.price_cents = price_cents
+        self.update_quantity_form = None
+
+    @property
+    def price(self):
+        return from_cents(self.price_cents)
+
+    @property
+    def total_price(self):
+        return from_cents(self.price_cents * self.quantity)
+
+
+def check_line(product, quantity, price_cents):
+    """
+    Reconcile a cart line with the product as it is now. Returns the
+    quantity and price to keep (quantity 0 drops the line) and a message
+    for the shopper when anything changed.
+    """
+    if product is None or not product.available:
+        name = product.name if product is not None else 'A product'
+        return 0, price_cents, f'{name} is no longer available and was removed from your cart.'
+    current_cents = to_cents(product.price)
+    messages = []
+    if current_cents != price_cents:
+        messages.append(f'The price of {product.name} changed from ${from_cents(price_cents)} '
+                        f'to ${product.price}.')
+    # Pre-orders are not limited by what is in stock
+    if not product.is_preorder and product.stock < quantity:
+        if product.stock == 0:
+            return 0, current_cents, f'{product.name} is out of stock and was removed from your cart.'
+        messages.append(f'Only {product.stock} of {product.name} left in stock; '
+                        f'your quantity was changed from {quantity} to {product.stock}.')
+        quantity = product.stock
+    return quantity, current_cents, ' '.join(messages) or None
+
 
 class Cart:
     def __init__(self, request):
@@ -8,30 +73,46 @@ class Cart:
         Initialize the cart.
         """
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        # An empty cart is only put in the session once something is added,
+        # so browsing never creates a session
+        self.cart = self.session.get(settings.CART_SESSION_ID) or {}
+        self._lines = None
 
     def add(self, product, quantity=1, override_quantity=False):
         """
         Add a product to the cart or update its quantity.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0, 'price': str(product.price)}
-        
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
-        
-        self.save()
+        self.apply([('set' if override_quantity else 'add', product, quantity)])
+
+    def apply(self, operations):
+        """
+        Apply a batch of ('add' | 'set' | 'remove', product, quantity)
+        operations with a single session save. Returns {product id:
+        (quantity, price in cents)} for every line touched, with None for
+        removed lines.
+        """
+        changed = {}
+        for operation, product, quantity in operations:
+            product_id = str(product.id)
+            if operation == 'remove':
+                self.cart.pop(product_id, None)
+                changed[product.id] = None
+                continue
+            if product_id not in self.cart:
+                # Prices are kept as integer cents to keep the session small
+                self.cart[product_id] = {'quantity': 0, 'price': to_cents(product.price)}
+            item = self.cart[product_id]
+            item['quantity'] = quantity if operation == 'set' else item['quantity'] + quantity
+            changed[product.id] = (item['quantity'], _stored_cents(item['price']))
+        if changed:
+            self.save()
+        return changed
 
     def save(self):
+        self.session[settings.CART_SESSION_ID] = self.cart
         # mark the session as "modified" to make sure it gets saved
         self.session.modified = True
+        self._lines = None
 
     def remove(self, product):
         """
@@ -42,22 +123,53 @@ class Cart:
             del self.cart[product_id]
             self.save()
 
-    def __iter__(self):
+    def lines(self):
         """
-        Iterate over the items in the cart and get the products from the database.
+        Return the cart lines with their products, fetched in one query the
+        first time they are needed.
         """
-        product_ids = self.cart.keys()
-        # get the product objects and add them to the cart
-        products = Product.objects.filter(id__in=product_ids)
+        if self._lines is None:
+            products = Product.objects.in_bulk([int(pk) for pk in self.cart])
+            # Products deleted since they were added are left out
+            self._lines = [
+                CartLine(products[int(pk)], item['quantity'], _stored_cents(item['price']))
+                for pk, item in self.cart.items()
+                if int(pk) in products
+            ]
+        return self._lines
 
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
+    def revalidate(self):
+        """
+        Bring every line up to date with its product's current price,
+        availability and stock using one query, and return the messages
+        describing what changed.
+        """
+        products = Product.objects.in_bulk([int(pk) for pk in self.cart])
+        lines = []
+        changes = []
+        for pk, item in list(self.cart.items()):
+            product = products.get(int(pk))
+            price_cents = _stored_cents(item['price'])
+            quantity, new_cents, message = check_line(product, item['quantity'], price_cents)
+            if message:
+                changes.append(message)
+            if not quantity:
+                del self.cart[pk]
+                continue
+            if (quantity, new_cents) != (item['quantity'], price_cents):
+                item['quantity'], item['price'] = quantity, new_cents
+            lines.append(CartLine(product, quantity, new_cents))
+        if changes:
+            self.save()
+        # Checkout shows these lines next, so keep them
+        self._lines = lines
+        return changes
 
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+    def __iter__(self):
+        """
+        Iterate over the items in the cart without changing the session data.
+        """
+        return iter(self.lines())
 
     def __len__(self):
         """
@@ -69,11 +181,197 @@ class Cart:
         """
         Calculate the total cost of items in the cart.
         """
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return from_cents(sum(_stored_cents(item['price']) * item['quantity']
+                              for item in self.cart.values()))
 
     def clear(self):
         """
         Remove cart from session.
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.session.modified = True
+        self.cart = {}
+        self._lines = None
+
+
+def _lock_user_cart(user_cart):
+    """
+    Lock the cart row until the end of the transaction, so changes that
+    read its lines and write them back (two tabs, a login merge) apply one
+    after the other instead of losing each other's lines.
+    """
+    list(UserCart.objects.select_for_update().filter(pk=user_cart.pk).values_list('pk', flat=True))
+
+
+class UserCartStore:
+    """
+    The cart of a signed-in user, stored in UserCart rows. Offers the same
+    interface as Cart.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.user_cart = UserCart.objects.filter(user=user).first()
+        self._lines = None
+
+    def _get_or_create_cart(self):
+        if self.user_cart is None:
+            self.user_cart, _ = UserCart.objects.get_or_create(user=self.user)
+        return self.user_cart
+
+    def add(self, product, quantity=1, override_quantity=False):
+        """
+        Add a product to the cart or update its quantity.
+        """
+        self.apply([('set' if override_quantity else 'add', product, quantity)])
+
+    def apply(self, operations):
+        """
+        Apply a batch of operations like Cart.apply, reading the affected
+        lines in one query and writing them back in bulk.
+        """
+        if not operations:
+            return {}
+        user_cart = self._get_or_create_cart()
+        with transaction.atomic():
+            _lock_user_cart(user_cart)
+            stored = {item.product_id: item for item in
+                      user_cart.items.filter(product__in=[product for _, product, _ in operations])}
+            changed = {}
+            for operation, product, quantity in operations:
+                if operation == 'remove':
+                    stored.pop(product.id, None)
+                    changed[product.id] = None
+                    continue
+                item = stored.get(product.id)
+                if item is None:
+                    item = stored[product.id] = UserCartItem(
+                        cart=user_cart, product=product, quantity=0, price=product.price
+                    )
+                item.quantity = quantity if operation == 'set' else item.quantity + quantity
+                changed[product.id] = (item.quantity, to_cents(item.price))
+
+            removed = [pk for pk, line in changed.items() if line is None]
+            kept = [stored[pk] for pk, line in changed.items() if line is not None]
+            if removed:
+                user_cart.items.filter(product__in=removed).delete()
+            UserCartItem.objects.bulk_update([item for item in kept if item.pk], ['quantity'])
+            UserCartItem.objects.bulk_create(
+                [item for item in kept if not item.pk], update_conflicts=True,
+                unique_fields=['cart', 'product'], update_fields=['quantity'],
+            )
+            self.save()
+        return changed
+
+    def save(self):
+        self.user_cart.update_totals()
+        self._lines = None
+
+    def remove(self, product):
+        """
+        Remove a product from the cart.
+        """
+        if self.user_cart is None:
+            return
+        with transaction.atomic():
+            if self.user_cart.items.filter(product=product).delete()[0]:
+                self.save()
+
+    def lines(self):
+        if self._lines is None:
+            items = self.user_cart.items.select_related('product') if self.user_cart else []
+            self._lines = [CartLine(item.product, item.quantity, to_cents(item.price))
+                           for item in items]
+        return self._lines
+
+    def revalidate(self):
+        """
+        Like Cart.revalidate, for the stored cart.
+        """
+        if self.user_cart is None:
+            return []
+        lines = []
+        changes = []
+        updated = []
+        removed = []
+        for item in self.user_cart.items.select_related('product'):
+            price_cents = to_cents(item.price)
+            quantity, new_cents, message = check_line(item.product, item.quantity, price_cents)
+            if message:
+                changes.append(message)
+            if not quantity:
+                removed.append(item.pk)
+                continue
+            if (quantity, new_cents) != (item.quantity, price_cents):
+                item.quantity, item.price = quantity, from_cents(new_cents)
+                updated.append(item)
+            lines.append(CartLine(item.product, quantity, new_cents))
+        if changes:
+            with transaction.atomic():
+                UserCartItem.objects.filter(pk__in=removed).delete()
+                UserCartItem.objects.bulk_update(updated, ['quantity', 'price'])
+                self.user_cart.update_totals()
+        self._lines = lines
+        return changes
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __len__(self):
+        return self.user_cart.item_count if self.user_cart else 0
+
+    def get_total_price(self):
+        return self.user_cart.total_price if self.user_cart else Decimal('0')
+
+    def clear(self):
+        """
+        Remove every item from the cart.
+        """
+        if self.user_cart is None:
+            return
+        with transaction.atomic():
+            self.user_cart.items.all().delete()
+            self.save()
+
+
+def merge_session_cart(user, session_cart):
+    """
+    Move a session cart's lines into the user's stored cart, adding up the
+    quantities of products that are in both.
+    """
+    if not session_cart:
+        return
+    user_cart, _ = UserCart.objects.get_or_create(user=user)
+    session_lines = {int(pk): item for pk, item in session_cart.items()}
+    with transaction.atomic():
+        _lock_user_cart(user_cart)
+        # One query for which products still exist and what is already stored
+        existing = Product.objects.filter(id__in=session_lines).annotate(
+            cart_quantity=Subquery(
+                UserCartItem.objects.filter(cart=user_cart, product=OuterRef('pk')).values('quantity')
+            )
+        ).values_list('id', 'cart_quantity')
+        items = [
+            UserCartItem(cart=user_cart, product_id=product_id,
+                         quantity=(cart_quantity or 0) + session_lines[product_id]['quantity'],
+                         price=from_cents(_stored_cents(session_lines[product_id]['price'])))
+            for product_id, cart_quantity in existing
+        ]
+        # Lines already stored keep their price and only gain quantity
+        UserCartItem.objects.bulk_create(
+            items, update_conflicts=True,
+            unique_fields=['cart', 'product'], update_fields=['quantity'],
+        )
+        user_cart.update_totals()
+
+
+def get_cart(request):
+    """
+    Return the request's cart, creating it only once per request.
+    """
+    if not hasattr(request, '_cart'):
+        if request.user.is_authenticated:
+            request._cart = UserCartStore(request.user)
+        else:
+            request._cart = Cart(request)
+    return request._cart
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+CACHED_ENGINE = 'cart.sessions'
+
+# Each process gets its own copy of these, so sessions cached in them go
+# stale as soon as a second worker serves the same visitor
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    if settings.SESSION_ENGINE != CACHED_ENGINE:
+        return []
+    backend = settings.CACHES.get(settings.SESSION_CACHE_ALIAS, {}).get('BACKEND')
+    if backend is None or backend in LOCAL_CACHE_BACKENDS:
+        return [Error(
+            f'{CACHED_ENGINE} needs a session cache shared by all processes.',
+            hint=('Set SESSION_CACHE_URL to a Redis URL, point the '
+                  f'{settings.SESSION_CACHE_ALIAS!r} cache at memcached or the '
+                  'database cache, or use django.contrib.sessions.backends.db.'),
+            id='cart.E001',
+        )]
+    return []
@@ -1,4 +1,7 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    # Lazy so pages that never show the cart don't even read the session
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
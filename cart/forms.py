@@ -11,4 +11,34 @@ class CartAddProductForm(forms.Form):
         required=False,
         initial=False,
         widget=forms.HiddenInput
-    )
\ No newline at end of file
+    )
+
+BATCH_OPERATIONS = ('add', 'set', 'remove')
+MAX_BATCH_SIZE = 50
+MAX_QUANTITY = PRODUCT_QUANTITY_CHOICES[-1][0]
+
+
+def parse_batch(data):
+    """
+    Validate a batch request body such as
+    {"operations": [{"op": "add", "product": 3, "quantity": 2},
+                    {"op": "remove", "product": 5}]}
+    and return it as a list of (op, product id, quantity).
+    """
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise forms.ValidationError('"operations" must be a non-empty list.')
+    if len(operations) > MAX_BATCH_SIZE:
+        raise forms.ValidationError(f'At most {MAX_BATCH_SIZE} operations per request.')
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+            raise forms.ValidationError(f'Operation {index}: "op" must be one of {", ".join(BATCH_OPERATIONS)}.')
+        product_id = operation.get('product')
+        if type(product_id) is not int:
+            raise forms.ValidationError(f'Operation {index}: "product" must be a product id.')
+        quantity = operation.get('quantity', 1)
+        if operation['op'] != 'remove' and (type(quantity) is not int or not 1 <= quantity <= MAX_QUANTITY):
+            raise forms.ValidationError(f'Operation {index}: "quantity" must be between 1 and {MAX_QUANTITY}.')
+        parsed.append((operation['op'], product_id, quantity))
+    return parsed
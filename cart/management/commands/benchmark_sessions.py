@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, connections
+from django.core.management.base import BaseCommand
+
+ENGINES = ['django.contrib.sessions.backends.db', 'cart.sessions']
+
+
+class Command(BaseCommand):
+    help = ('Compare session engines under concurrent add-to-cart traffic. '
+            'Writes to and then removes sessions in the configured database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Concurrent shoppers')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Add-to-cart requests per shopper')
+        parser.add_argument('--products', type=int, default=20,
+                            help='Distinct products shoppers pick from')
+        parser.add_argument('--engine', action='append', dest='engines',
+                            help=f'Session engine to run (default: {", ".join(ENGINES)})')
+
+    def shopper(self, store_class, seed, requests, products):
+        """
+        One visitor adding products to their cart, a session load and save
+        per request like SessionMiddleware does.
+        """
+        rng = random.Random(seed)
+        timings = []
+        errors = 0
+        session_key = None
+        try:
+            for n in range(requests):
+                started = time.perf_counter()
+                try:
+                    session = store_class(session_key)
+                    cart = session.get(settings.CART_SESSION_ID) or {}
+                    item = cart.setdefault(str(rng.randrange(1, products + 1)),
+                                           {'quantity': 0, 'price': 1999})
+                    # Every third request submits a quantity the line already
+                    # has, like pressing "Update" on an unchanged cart row
+                    if n % 3 != 2:
+                        item['quantity'] += 1
+                    session[settings.CART_SESSION_ID] = cart
+                    session.save()
+                    session_key = session.session_key
+                except DatabaseError:
+                    errors += 1
+                timings.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+        return timings, errors, session_key
+
+    def run_engine(self, engine, options):
+        store_class = import_module(engine).SessionStore
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(
+                lambda seed: self.shopper(store_class, seed, options['requests'], options['products']),
+                range(options['threads']),
+            ))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(t for result in results for t in result[0])
+        session_keys = [result[2] for result in results if result[2]]
+        sizes = [len(data) for data in Session.objects.filter(session_key__in=session_keys)
+                 .values_list('session_data', flat=True)]
+        for session_key in session_keys:
+            store_class().delete(session_key)
+
+        return {
+            'requests': len(timings),
+            'rate': len(timings) / elapsed,
+            'p50': statistics.median(timings) * 1000,
+            'p95': timings[int(len(timings) * 0.95) - 1] * 1000,
+            'errors': sum(result[1] for result in results),
+            'size': statistics.mean(sizes) if sizes else 0,
+        }
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{options["threads"]} shoppers x {options["requests"]} add-to-cart requests')
+        self.stdout.write(f'{"engine":<40} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+                          f'{"errors":>7} {"bytes":>6}')
+        for engine in options['engines'] or ENGINES:
+            if engine == 'cart.sessions' and settings.SESSION_CACHE_ALIAS not in settings.CACHES:
+                self.stdout.write(f'{engine:<40} skipped: SESSION_CACHE_URL is not set')
+                continue
+            result = self.run_engine(engine, options)
+            self.stdout.write(
+                f'{engine:<40} {result["rate"]:>8.0f} {result["p50"]:>8.2f} '
+                f'{result["p95"]:>8.2f} {result["errors"]:>7} {result["size"]:>6.0f}'
+            )
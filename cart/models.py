@@ -1,4 +1,47 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F, Sum
+
+from products.models import Product
+
+# Anonymous visitors keep their cart in the session (see cart.cart.Cart).
+# Signed-in users get these rows instead, so the cart follows them across
+# devices; the session cart is merged in when they log in.
+
+
+class UserCart(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    # Denormalized from the items so the header badge and totals are
+    # column reads rather than aggregates
+    item_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Cart of {self.user}'
+
+    def update_totals(self):
+        totals = self.items.aggregate(count=Sum('quantity'), total=Sum(F('price') * F('quantity')))
+        self.item_count = totals['count'] or 0
+        self.total_price = totals['total'] or Decimal('0')
+        self.save(update_fields=['item_count', 'total_price', 'updated'])
+
+
+class UserCartItem(models.Model):
+    cart = models.ForeignKey(UserCart, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    # Unit price when the product was added, like the session cart keeps
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('added', 'id')
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
 
-# Cart functionality will be session-based, so we don't need models here.
-# We'll implement the cart as a class that will be stored in the session.
\ No newline at end of file
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id}'
@@ -0,0 +1,67 @@
+"""
+Session engine and serializer tuned for the cart.
+
+SessionStore keeps sessions in a cache in front of the database, like
+Django's cached_db engine, and skips the database write entirely when a
+request marked the session modified without changing its contents (e.g. a
+cart update that sets the same quantity again). Django already saves a
+session at most once per request, so all cart changes made while handling
+a request end up in that one write. The cache must be shared by every
+worker process (Redis, memcached or the database cache); settings only
+select this engine when one is configured.
+
+CompactJSONSerializer stores each cart line as [quantity, price in cents]
+instead of {"quantity": ..., "price": ...}.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.core.signing import JSONSerializer
+
+KEY_PREFIX = 'cart.sessions'
+
+
+class CompactJSONSerializer(JSONSerializer):
+    def dumps(self, obj):
+        cart = obj.get(settings.CART_SESSION_ID)
+        if cart:
+            obj = dict(obj)
+            obj[settings.CART_SESSION_ID] = {
+                product_id: [item['quantity'], item['price']]
+                for product_id, item in cart.items()
+            }
+        return super().dumps(obj)
+
+    def loads(self, data):
+        obj = super().loads(data)
+        cart = obj.get(settings.CART_SESSION_ID)
+        if cart:
+            obj[settings.CART_SESSION_ID] = {
+                # Sessions written before this serializer hold dicts already
+                product_id: item if isinstance(item, dict) else {'quantity': item[0], 'price': item[1]}
+                for product_id, item in cart.items()
+            }
+        return obj
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def _digest(self, data):
+        return hashlib.md5(self.serializer().dumps(data), usedforsecurity=False).hexdigest()
+
+    def load(self):
+        data = super().load()
+        # Cart code changes the loaded dicts in place, so remember what was
+        # loaded by content rather than by reference
+        self._loaded_digest = self._digest(data) if data else None
+        return data
+
+    def save(self, must_create=False):
+        if not must_create and not settings.SESSION_SAVE_EVERY_REQUEST and self.session_key:
+            digest = self._digest(self._get_session())
+            if digest == getattr(self, '_loaded_digest', None):
+                return
+        super().save(must_create)
+        self._loaded_digest = self._digest(self._get_session())
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .cart import merge_session_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    Move what was put in the cart before logging in into the user's cart.
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    session_cart = request.session.pop(settings.CART_SESSION_ID, None)
+    if session_cart:
+        merge_session_cart(user, session_cart)
+    # A cart built earlier in this request belongs to the anonymous visitor
+    if hasattr(request, '_cart'):
+        del request._cart
@@ -1,8 +1,18 @@
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
 from products.models import Category, Product
-from .cart import Cart
+from .cart import Cart, UserCartStore, merge_session_cart
+from .models import UserCart, UserCartItem
+from .sessions import CompactJSONSerializer, SessionStore
+import copy
 from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.checks import run_checks
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.sessions.middleware import SessionMiddleware
 
 class CartTest(TestCase):
@@ -74,6 +84,44 @@ class CartTest(TestCase):
         self.cart = Cart(self.request)
         self.assertEqual(len(self.cart), 0)
 
+    def test_prices_are_stored_in_cents(self):
+        self.cart.add(self.product, quantity=2)
+        self.assertEqual(self.cart.cart[str(self.product.id)], {'quantity': 2, 'price': 9999})
+
+    def test_iteration_leaves_session_untouched(self):
+        self.cart.add(self.product, quantity=2)
+        stored = copy.deepcopy(self.request.session[settings.CART_SESSION_ID])
+        with self.assertNumQueries(1):
+            lines = list(self.cart)
+            list(self.cart)
+        self.assertEqual(self.request.session[settings.CART_SESSION_ID], stored)
+        self.assertEqual(lines[0].product, self.product)
+        self.assertEqual(lines[0].price, Decimal('99.99'))
+        self.assertEqual(lines[0].total_price, Decimal('199.98'))
+
+    def test_revalidate_uses_one_query(self):
+        preorder = Product.objects.create(category=self.category, name='Pre-Order Coat',
+                                          slug='preorder-coat', price=Decimal('150.00'),
+                                          stock=0, is_preorder=True)
+        self.cart.add(self.product, quantity=2)
+        self.cart.add(preorder, quantity=5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cart.revalidate(), [])
+            self.assertEqual(len(list(self.cart)), 2)
+
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.assertEqual(self.cart.revalidate(),
+                         ['Test Product is out of stock and was removed from your cart.'])
+        self.assertEqual([line.product for line in self.cart], [preorder])
+
+    def test_legacy_string_prices(self):
+        self.request.session[settings.CART_SESSION_ID] = {
+            str(self.product.id): {'quantity': 3, 'price': '99.99'}
+        }
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_total_price(), Decimal('299.97'))
+        self.assertEqual([line.price for line in cart], [Decimal('99.99')])
+
 class CartViewsTest(TestCase):
     def setUp(self):
         self.category = Category.objects.create(
@@ -120,4 +168,214 @@ class CartViewsTest(TestCase):
         
         # Check if product was removed from cart
         response = self.client.get(reverse('cart:cart_detail'))
-        self.assertNotContains(response, 'Test Product')
\ No newline at end of file
+        self.assertNotContains(response, 'Test Product')
+
+    def test_browsing_does_not_create_a_session(self):
+        for url in (reverse('products:product_list'), self.product.get_absolute_url(),
+                    reverse('cart:cart_detail')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_cart_products_are_fetched_once_per_request(self):
+        self.client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 2, 'override': False}
+        )
+        # The cart page and the badge in the header share one cart
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(response, 'Test Product')
+        product_queries = [q for q in queries if 'FROM "products_product"' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+
+
+# A per-process cache is fine for a single test process
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+})
+class CartSessionStoreTest(TestCase):
+    def setUp(self):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+    def test_cart_is_serialized_compactly(self):
+        serializer = CompactJSONSerializer()
+        data = {settings.CART_SESSION_ID: {'7': {'quantity': 2, 'price': 1999}}}
+        self.assertEqual(serializer.dumps(data), b'{"cart":{"7":[2,1999]}}')
+        self.assertEqual(serializer.loads(serializer.dumps(data)), data)
+        # Sessions stored by the plain JSON serializer still load
+        self.assertEqual(serializer.loads(b'{"cart":{"7":{"quantity":2,"price":1999}}}'), data)
+
+    def test_unchanged_session_is_not_written(self):
+        session = SessionStore()
+        session[settings.CART_SESSION_ID] = {'7': {'quantity': 2, 'price': 1999}}
+        session.save()
+
+        session = SessionStore(session.session_key)
+        with self.assertNumQueries(0):
+            # Loaded from the cache, and saving the same data is skipped
+            session[settings.CART_SESSION_ID]['7']['quantity'] = 2
+            session.modified = True
+            session.save()
+
+        session[settings.CART_SESSION_ID]['7']['quantity'] = 3
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertEqual(sum('UPDATE "django_session"' in q['sql'] for q in queries), 1)
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        self.assertEqual(SessionStore(session.session_key)[settings.CART_SESSION_ID]['7']['quantity'], 3)
+
+    @override_settings(SESSION_ENGINE='cart.sessions')
+    def test_requests_read_sessions_from_the_cache(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(category=category, name='Linen Shirt', slug='linen-shirt',
+                                         price=Decimal('45.00'), stock=3)
+        self.client.post(reverse('cart:cart_add', args=[product.id]), {'quantity': 2, 'override': False})
+        self.assertIsInstance(self.client.session, SessionStore)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(response, 'Linen Shirt')
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+
+    def test_cached_engine_requires_a_shared_cache(self):
+        with self.settings(SESSION_ENGINE='cart.sessions'):
+            errors = [e.id for e in run_checks(tags=['caches'])]
+            self.assertIn('cart.E001', errors)
+            shared = dict(settings.CACHES, sessions={
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': 'redis://localhost:6379/1',
+            })
+            with self.settings(CACHES=shared):
+                errors = [e.id for e in run_checks(tags=['caches'])]
+                self.assertNotIn('cart.E001', errors)
+        # Without a shared cache sessions stay in the database only
+        self.assertEqual(settings.SESSION_ENGINE, 'django.contrib.sessions.backends.db')
+
+
+class UserCartTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=10)
+        self.hat = Product.objects.create(category=category, name='Hat', slug='hat',
+                                          price=Decimal('5.50'), stock=10)
+
+    def add(self, product, quantity):
+        return self.client.post(reverse('cart:cart_add', args=[product.id]),
+                                {'quantity': quantity, 'override': False})
+
+    def test_signed_in_cart_is_stored_with_totals(self):
+        self.client.force_login(self.user)
+        self.add(self.shirt, 2)
+        self.add(self.hat, 1)
+        self.add(self.shirt, 1)
+
+        user_cart = UserCart.objects.get(user=self.user)
+        self.assertEqual(user_cart.item_count, 4)
+        self.assertEqual(user_cart.total_price, Decimal('65.50'))
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+
+        cart = UserCartStore(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cart), 4)
+            self.assertEqual(cart.get_total_price(), Decimal('65.50'))
+        self.assertEqual([(line.product, line.quantity) for line in cart],
+                         [(self.shirt, 3), (self.hat, 1)])
+
+        self.client.get(reverse('cart:cart_remove', args=[self.hat.id]))
+        user_cart.refresh_from_db()
+        self.assertEqual((user_cart.item_count, user_cart.total_price), (3, Decimal('60.00')))
+
+    def test_session_cart_is_merged_on_login(self):
+        user_cart = UserCart.objects.create(user=self.user)
+        UserCartItem.objects.create(cart=user_cart, product=self.shirt, quantity=1, price=Decimal('18.00'))
+        self.add(self.shirt, 2)
+        self.add(self.hat, 3)
+
+        self.client.login(username='shopper', password='secret-pass-123')
+
+        items = {item.product_id: item for item in user_cart.items.all()}
+        self.assertEqual(items[self.shirt.id].quantity, 3)
+        # The stored line keeps its price, new lines take the session's
+        self.assertEqual(items[self.shirt.id].price, Decimal('18.00'))
+        self.assertEqual(items[self.hat.id].price, Decimal('5.50'))
+        user_cart.refresh_from_db()
+        self.assertEqual((user_cart.item_count, user_cart.total_price), (6, Decimal('70.50')))
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+
+    def test_stored_lines_are_read_after_locking_the_cart(self):
+        user_cart = UserCart.objects.create(user=self.user)
+        UserCartItem.objects.create(cart=user_cart, product=self.shirt, quantity=1, price=Decimal('18.00'))
+        with CaptureQueriesContext(connection) as queries:
+            merge_session_cart(self.user, {str(self.shirt.id): {'quantity': 2, 'price': 2000}})
+        statements = [q['sql'] for q in queries]
+
+        def position(test):
+            return next(index for index, sql in enumerate(statements) if test(sql))
+
+        savepoint = position(lambda sql: sql.startswith('SAVEPOINT'))
+        lock = position(lambda sql: sql.startswith('SELECT "cart_usercart"."id" AS "pk" FROM'))
+        read = position(lambda sql: 'FROM "cart_usercartitem"' in sql)
+        self.assertLess(savepoint, lock)
+        self.assertLess(lock, read)
+        self.assertEqual(user_cart.items.get().quantity, 3)
+
+
+class CartBatchApiTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=10)
+        self.hat = Product.objects.create(category=category, name='Hat', slug='hat',
+                                          price=Decimal('5.50'), stock=10)
+
+    def batch(self, *operations):
+        return self.client.post(reverse('cart:cart_batch'), {'operations': list(operations)},
+                                content_type='application/json')
+
+    def test_batch_returns_changed_lines_and_totals(self):
+        self.batch({'op': 'add', 'product': self.hat.id})
+        response = self.batch(
+            {'op': 'add', 'product': self.shirt.id, 'quantity': 2},
+            {'op': 'add', 'product': self.shirt.id, 'quantity': 1},
+            {'op': 'set', 'product': self.hat.id, 'quantity': 4},
+        )
+        self.assertEqual(response.json(), {
+            'lines': [
+                {'product': self.shirt.id, 'quantity': 3, 'price': '20.00', 'total_price': '60.00'},
+                {'product': self.hat.id, 'quantity': 4, 'price': '5.50', 'total_price': '22.00'},
+            ],
+            'total_price': '82.00',
+            'count': 7,
+        })
+
+        response = self.batch({'op': 'remove', 'product': self.shirt.id})
+        self.assertEqual(response.json(), {
+            'lines': [{'product': self.shirt.id, 'quantity': 0}],
+            'total_price': '22.00',
+            'count': 4,
+        })
+
+    def test_batch_for_signed_in_user(self):
+        user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        self.client.force_login(user)
+        self.batch({'op': 'add', 'product': self.shirt.id, 'quantity': 2},
+                   {'op': 'add', 'product': self.hat.id})
+        response = self.batch({'op': 'set', 'product': self.shirt.id, 'quantity': 1},
+                              {'op': 'remove', 'product': self.hat.id})
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(UserCart.objects.get(user=user).total_price, Decimal('20.00'))
+        self.assertEqual(list(UserCartItem.objects.values_list('product_id', 'quantity')),
+                         [(self.shirt.id, 1)])
+
+    def test_invalid_batches_change_nothing(self):
+        response = self.batch({'op': 'add', 'product': self.shirt.id, 'quantity': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.batch({'op': 'add', 'product': self.shirt.id},
+                              {'op': 'add', 'product': 999999})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['products'], [999999])
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
@@ -1,12 +1,16 @@
+import json
+
+from django import forms
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 from products.models import Product
-from .cart import Cart
-from .forms import CartAddProductForm
+from .cart import from_cents, get_cart
+from .forms import CartAddProductForm, parse_batch
 
 @require_POST
 def cart_add(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     
@@ -19,15 +23,53 @@ def cart_add(request, product_id):
     return redirect('cart:cart_detail')
 
 def cart_remove(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
     return redirect('cart:cart_detail')
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     for item in cart:
-        item['update_quantity_form'] = CartAddProductForm(
-            initial={'quantity': item['quantity'],
+        item.update_quantity_form = CartAddProductForm(
+            initial={'quantity': item.quantity,
                      'override': True})
-    return render(request, 'cart/detail.html', {'cart': cart})
\ No newline at end of file
+    return render(request, 'cart/detail.html', {'cart': cart})
+
+@require_POST
+def cart_batch(request):
+    """
+    Apply several cart changes at once and return only what changed, for
+    clients that update the cart without reloading the page.
+    """
+    try:
+        operations = parse_batch(json.loads(request.body))
+    except (ValueError, forms.ValidationError) as exc:
+        message = exc.messages[0] if isinstance(exc, forms.ValidationError) else 'Invalid JSON.'
+        return JsonResponse({'error': message}, status=400)
+
+    products = Product.objects.in_bulk({product_id for _, product_id, _ in operations})
+    missing = sorted({product_id for _, product_id, _ in operations} - products.keys())
+    if missing:
+        return JsonResponse({'error': 'Unknown products.', 'products': missing}, status=404)
+
+    cart = get_cart(request)
+    changed = cart.apply([(op, products[product_id], quantity)
+                          for op, product_id, quantity in operations])
+    lines = []
+    for product_id, line in changed.items():
+        if line is None:
+            lines.append({'product': product_id, 'quantity': 0})
+            continue
+        quantity, price_cents = line
+        lines.append({
+            'product': product_id,
+            'quantity': quantity,
+            'price': str(from_cents(price_cents)),
+            'total_price': str(from_cents(price_cents * quantity)),
+        })
+    return JsonResponse({
+        'lines': lines,
+        'total_price': str(cart.get_total_price()),
+        'count': len(cart),
+    })
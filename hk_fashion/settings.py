@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'orders',
     'users',
     'pages',
+    'outbox',
 ]
 
 MIDDLEWARE = [
@@ -73,6 +74,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'cart.context_processors.cart',  # We'll create this later
+                'products.context_processors.categories',
             ],
         },
     },
@@ -92,6 +94,39 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+# Sessions
+# cart.sessions keeps sessions in a cache in front of the database, which
+# only works when every worker process shares that cache: with a per-process
+# cache one worker can serve a cart that another has since changed. Set
+# SESSION_CACHE_URL to a Redis URL to use it; otherwise sessions stay in the
+# database. Memcached or the database cache work too; cart/checks.py rejects
+# caches local to one process.
+
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_CACHE_URL = os.environ.get('SESSION_CACHE_URL')
+if SESSION_CACHE_URL:
+    # Kept apart from 'default' so busy product caches never evict sessions
+    CACHES[SESSION_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': SESSION_CACHE_URL,
+    }
+    SESSION_ENGINE = 'cart.sessions'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+SESSION_SERIALIZER = 'cart.sessions.CompactJSONSerializer'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,9 +174,31 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Seconds a product listing's total count is reused before recounting (0 disables)
+PRODUCT_COUNT_CACHE_TIMEOUT = 300
+
+# Seconds a rendered product card is kept (cards are keyed on Product.updated)
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds the rendered home page is served to anonymous visitors (the feed
+# version in the key changes whenever products change)
+HOME_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Email is sent by the process_outbox worker, never during a request.
+# Messages are written to files until a real backend is configured.
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+DEFAULT_FROM_EMAIL = 'HK Fashion <info@hkfashion.com>'
+# Where contact form notifications go
+CONTACT_NOTIFICATION_EMAIL = 'info@hkfashion.com'
+
 # Cart session ID
 CART_SESSION_ID = 'cart'
 
+# Delivered and cancelled orders older than this move to the archive
+# tables (see the archive_orders command)
+ORDER_ARCHIVE_AFTER_DAYS = 365
+
 # Login URL
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
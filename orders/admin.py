@@ -1,14 +1,148 @@
-from django.contrib import admin
-from .models import Order, OrderItem
+from django.contrib import admin, messages
+from django.db.models.functions import Lower
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.http import urlencode
+from .pagination import EstimatedCountPaginator
+from . import exports, sales, transitions
+from .models import ArchivedOrder, ArchivedOrderItem, DailySales, Order, OrderItem
+
+def search_orders(queryset, search_term):
+    # Only lookups the indexes can serve: the primary key, or the email
+    # through the LOWER(email) index, instead of LIKE over every row
+    term = search_term.strip().lstrip('#')
+    if not term:
+        return queryset
+    if term.isdigit():
+        return queryset.filter(id=int(term))
+    return queryset.alias(email_lower=Lower('email')).filter(email_lower=term.lower())
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ['product']
 
+class BaseOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'first_name', 'last_name', 'email', 'user',
+                    'city', 'created', 'status', 'item_count', 'total_cost']
+    list_select_related = ['user']
+    ordering = ['-created', '-id']
+    search_fields = ['=id', '=email']
+    search_help_text = 'Order number or exact email address'
+    # Large order tables: no exact COUNT(*) for the page links or for the
+    # "n total" next to search results
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        return search_orders(queryset, search_term), False
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'first_name', 'last_name', 'email',
-                    'address', 'postal_code', 'city', 'created',
-                    'updated', 'status']
+class OrderAdmin(BaseOrderAdmin):
     list_filter = ['created', 'updated', 'status']
-    inlines = [OrderItemInline]
\ No newline at end of file
+    readonly_fields = ['total_cost', 'item_count']
+    raw_id_fields = ['user']
+    inlines = [OrderItemInline]
+    actions = ['export_csv', 'mark_processing', 'mark_shipped', 'mark_delivered', 'mark_cancelled']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Point to archived orders matching the search as well
+        if search_term.strip() and search_orders(ArchivedOrder.objects.all(), search_term).exists():
+            url = reverse('admin:orders_archivedorder_changelist')
+            self.message_user(request, format_html(
+                'Archived orders also match. <a href="{}?{}">Search the archive</a>.',
+                url, urlencode({'q': search_term.strip()}),
+            ), messages.INFO)
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.action(description='Export selected orders with their items as CSV')
+    def export_csv(self, request, queryset):
+        filename = f'orders-{timezone.localdate():%Y-%m-%d}.csv'
+        return exports.csv_response(exports.order_item_rows(queryset), filename)
+
+    def transition(self, request, queryset, status):
+        moved, skipped = transitions.transition(queryset, status)
+        self.message_user(request, f'{moved} orders marked as {status}.')
+        if skipped:
+            self.message_user(request, f'{skipped} orders skipped: their status does not allow '
+                                       f'moving to {status}.', messages.WARNING)
+
+    @admin.action(description='Mark selected orders as processing')
+    def mark_processing(self, request, queryset):
+        self.transition(request, queryset, 'processing')
+
+    @admin.action(description='Mark selected orders as shipped')
+    def mark_shipped(self, request, queryset):
+        self.transition(request, queryset, 'shipped')
+
+    @admin.action(description='Mark selected orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self.transition(request, queryset, 'delivered')
+
+    @admin.action(description='Mark selected orders as cancelled')
+    def mark_cancelled(self, request, queryset):
+        self.transition(request, queryset, 'cancelled')
+
+    def save_related(self, request, form, formsets, change):
+        # Swap the order's old lines for the edited ones in the daily sales
+        sales.record_order(form.instance, sign=-1)
+        super().save_related(request, form, formsets, change)
+        sales.record_order(form.instance)
+        # Items may have been added, changed or deleted through the inline
+        form.instance.update_totals()
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    """
+    Read-only reporting over the stored aggregates; the totals by category
+    cover whatever the filters select.
+    """
+    list_display = ['day', 'product', 'status', 'is_preorder', 'revenue', 'units', 'orders']
+    list_filter = ['status', 'is_preorder', 'product__category']
+    list_select_related = ['product']
+    date_hierarchy = 'day'
+    change_list_template = 'admin/orders/dailysales/change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            response.context_data['category_totals'] = sales.report('category', queryset=changelist.queryset)
+        return response
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ['product', 'price', 'quantity', 'is_preorder']
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(BaseOrderAdmin):
+    """
+    Orders moved out by archive_orders, read-only.
+    """
+    list_display = BaseOrderAdmin.list_display + ['archived']
+    list_filter = ['created', 'status']
+    inlines = [ArchivedOrderItemInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
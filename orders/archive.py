@@ -0,0 +1,105 @@
+"""
+Archiving old orders.
+
+Checkout only ever touches recent orders, so delivered and cancelled
+orders older than ORDER_ARCHIVE_AFTER_DAYS are moved to ArchivedOrder and
+ArchivedOrderItem, keeping Order and OrderItem (and their indexes) small.
+Each chunk is copied and deleted in one transaction, so archive_orders
+can be stopped at any point and simply run again.
+
+Archived orders keep their ids and stay visible to customers and staff:
+find_order() and history_querysets() look in both places.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+ORDER_FIELDS = [field.attname for field in ArchivedOrder._meta.concrete_fields
+                if field.name != 'archived']
+ITEM_FIELDS = [field.attname for field in ArchivedOrderItem._meta.concrete_fields]
+
+
+def archivable(days=None):
+    """
+    Orders old enough, and finished, to be archived.
+    """
+    if days is None:
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created__lt=cutoff)
+
+
+def archive_chunk(order_ids):
+    """
+    Move the given orders and their items to the archive tables. Returns
+    the number of orders moved.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(
+            pk__in=order_ids, status__in=ARCHIVABLE_STATUSES
+        ).order_by().values(*ORDER_FIELDS))
+        if not orders:
+            return 0
+        ids = [order['id'] for order in orders]
+        items = OrderItem.objects.filter(order__in=ids).order_by()
+        now = timezone.now()
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(archived=now, **order) for order in orders]
+        )
+        ArchivedOrderItem.objects.bulk_create(
+            [ArchivedOrderItem(**item) for item in items.values(*ITEM_FIELDS)]
+        )
+        # One DELETE per table, whatever the chunk size; the daily sales of
+        # an archived order stay counted
+        Order.objects.filter(pk__in=ids).delete(keep_sales=True)
+    return len(ids)
+
+
+def archive_orders(days=None, chunk_size=500, limit=None):
+    """
+    Archive every archivable order in chunks of ``chunk_size``, stopping
+    after ``limit`` orders if given. Yields the running total after each
+    chunk.
+    """
+    candidates = archivable(days)
+    moved = 0
+    last_pk = 0
+    while limit is None or moved < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - moved)
+        ids = list(candidates.filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        moved += archive_chunk(ids)
+        yield moved
+
+
+def history_querysets(user):
+    """
+    A customer's placed and archived orders.
+    """
+    return [Order.objects.filter(user=user), ArchivedOrder.objects.filter(user=user)]
+
+
+def find_order(user, order_id):
+    """
+    The customer's order with its items and their products, from the
+    archive if it is no longer among the placed orders.
+    """
+    for model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        items = item_model.objects.select_related('product')
+        order = model.objects.prefetch_related(Prefetch('items', queryset=items)).filter(
+            id=order_id, user=user
+        ).first()
+        if order is not None:
+            return order
+    raise Http404('No order matches the given query.')
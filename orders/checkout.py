@@ -0,0 +1,80 @@
+"""
+Placing orders.
+
+An order, its items and the stock they take are written in one
+transaction. Stock is taken with conditional UPDATEs (stock >= quantity),
+so two shoppers buying the last item cannot both get it: the second
+update matches no row and the whole checkout rolls back.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from outbox import events
+from products import facets
+from products.models import Product
+
+from . import sales
+from .models import OrderItem
+
+
+class OutOfStock(Exception):
+    """
+    Raised when some lines ask for more than is left. ``shortages`` is a
+    list of (product, requested quantity, available quantity).
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(', '.join(f'{product.name}: {available} left'
+                                   for product, _, available in shortages))
+
+    @property
+    def messages(self):
+        return [f'Only {available} of {product.name} left in stock; '
+                f'you asked for {requested}.' if available else
+                f'{product.name} has just sold out.'
+                for product, requested, available in self.shortages]
+
+
+def place_order(order, lines):
+    """
+    Save ``order`` with one item per cart line and take the items out of
+    stock, all or nothing. Pre-orders do not take stock.
+    """
+    lines = list(lines)
+    order.item_count = len(lines)
+    order.total_cost = sum((line.total_price for line in lines), Decimal('0'))
+    with transaction.atomic():
+        order.save()
+        shortages = []
+        # A stable order keeps concurrent checkouts from deadlocking on
+        # databases with row locks
+        for line in sorted(lines, key=lambda line: line.product.pk):
+            if line.product.is_preorder:
+                continue
+            taken = Product.objects.filter(
+                pk=line.product.pk, stock__gte=line.quantity
+            ).update(stock=F('stock') - line.quantity)
+            if not taken:
+                shortages.append(line)
+        if shortages:
+            stock = dict(Product.objects.filter(pk__in=[line.product.pk for line in shortages])
+                         .values_list('pk', 'stock'))
+            # The order row is rolled back with everything else
+            order.pk = None
+            order._state.adding = True
+            raise OutOfStock([(line.product, line.quantity, stock.get(line.product.pk, 0))
+                              for line in shortages])
+        items = OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=line.product, price=line.price,
+                      quantity=line.quantity, is_preorder=line.product.is_preorder)
+            for line in lines
+        ])
+        sales.record_order(order, items)
+        # Confirmation email and other follow-ups run in the outbox worker
+        events.enqueue('order.created', {'order_id': order.pk})
+        # The in-stock facet counts depend on stock
+        transaction.on_commit(facets.invalidate_facets)
+    return order
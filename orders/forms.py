@@ -2,6 +2,9 @@ from django import forms
 from .models import Order
 
 class OrderCreateForm(forms.ModelForm):
+    # Issued with the form so a resubmitted checkout can be recognized
+    idempotency_key = forms.CharField(widget=forms.HiddenInput, max_length=64, required=False)
+
     class Meta:
         model = Order
         fields = ['first_name', 'last_name', 'email', 'address', 'postal_code', 'city', 'note']
\ No newline at end of file
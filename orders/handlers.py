@@ -0,0 +1,47 @@
+from django.core.mail import send_mail
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from outbox import events
+
+from .models import Order, OrderItem
+
+
+@events.handler('order.created')
+def send_order_confirmation(payload):
+    items = OrderItem.objects.select_related('product')
+    order = Order.objects.prefetch_related(Prefetch('items', queryset=items)).filter(
+        pk=payload['order_id']
+    ).first()
+    if order is None:
+        return
+    send_mail(
+        f'Your HK Fashion order #{order.id}',
+        render_to_string('orders/emails/order_confirmation.txt', {'order': order}),
+        None,
+        [order.email],
+    )
+
+
+STATUS_EMAIL_SUBJECTS = {
+    'shipped': 'Your HK Fashion order #{id} is on its way',
+    'delivered': 'Your HK Fashion order #{id} has been delivered',
+    'cancelled': 'Your HK Fashion order #{id} has been cancelled',
+}
+
+
+@events.handler('order.status_changed')
+def send_status_update(payload):
+    subject = STATUS_EMAIL_SUBJECTS.get(payload['to'])
+    if subject is None:
+        return
+    order = Order.objects.filter(pk=payload['order_id']).first()
+    # Skip messages overtaken by a later change
+    if order is None or order.status != payload['to']:
+        return
+    send_mail(
+        subject.format(id=order.id),
+        render_to_string('orders/emails/order_status.txt', {'order': order}),
+        None,
+        [order.email],
+    )
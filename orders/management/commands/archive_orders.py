@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders import archive
+
+
+class Command(BaseCommand):
+    help = ('Move delivered and cancelled orders older than the given age to the archive '
+            'tables. Safe to interrupt and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help='Archive orders placed more than this many days ago '
+                                 '(default: ORDER_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Orders moved per transaction')
+        parser.add_argument('--limit', type=int,
+                            help='Stop after archiving this many orders')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        moved = 0
+        for moved in archive.archive_orders(options['days'], options['chunk_size'], options['limit']):
+            self.stdout.write(f'{moved} orders archived')
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} orders older than {options["days"]} days '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
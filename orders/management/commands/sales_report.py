@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from orders import sales
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Print revenue, units and orders from the daily sales aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=sorted(sales.REPORT_GROUPS), default='day')
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help='First day (YYYY-MM-DD)')
+        parser.add_argument('--until', type=datetime.date.fromisoformat,
+                            help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--status', action='append', dest='statuses',
+                            choices=[status for status, _ in Order.ORDER_STATUS_CHOICES],
+                            help='Only count orders with this status (repeatable; default: all but cancelled)')
+
+    def handle(self, *args, **options):
+        statuses = options['statuses'] or [status for status, _ in Order.ORDER_STATUS_CHOICES
+                                           if status != 'cancelled']
+        rows = sales.report(options['by'], since=options['since'], until=options['until'],
+                            statuses=statuses)
+        field = sales.REPORT_GROUPS[options['by']][0]
+        self.stdout.write(f'{options["by"].title():<30} {"Revenue":>12} {"Units":>8} {"Orders":>8}')
+        for row in rows:
+            self.stdout.write(f'{str(row[field]):<30} {row["revenue"]:>12.2f} {row["units"]:>8} {row["orders"]:>8}')
@@ -0,0 +1,62 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import transitions
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Move orders to a new status in batches, skipping orders whose status '
+            'does not allow it. Order numbers come from the arguments or a file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=sorted(transitions.ALLOWED_TRANSITIONS))
+        parser.add_argument('order_ids', nargs='*', type=int)
+        parser.add_argument('--ids-file',
+                            help='File with one order number per line ("-" for stdin)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders updated per transaction')
+
+    def read_ids(self, path):
+        lines = sys.stdin if path == '-' else open(path)
+        with lines:
+            for number, line in enumerate(lines, 1):
+                line = line.strip().lstrip('#')
+                if not line:
+                    continue
+                if not line.isdigit():
+                    raise CommandError(f'Line {number}: {line!r} is not an order number')
+                yield int(line)
+
+    def handle(self, *args, **options):
+        status = options['status']
+        batch_size = options['batch_size']
+        ids = list(options['order_ids'])
+        if options['ids_file']:
+            ids.extend(self.read_ids(options['ids_file']))
+        if not ids:
+            raise CommandError('Give order numbers as arguments or with --ids-file')
+        ids = list(dict.fromkeys(ids))
+
+        started = time.perf_counter()
+        moved = skipped = 0
+        # Chunks keep the IN lists within the database's parameter limits
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            chunk_moved, chunk_skipped = transitions.transition(
+                Order.objects.filter(pk__in=chunk), status, batch_size=batch_size
+            )
+            moved += chunk_moved
+            skipped += chunk_skipped
+        missing = len(ids) - moved - skipped
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} orders marked as {status} in {time.perf_counter() - started:.1f}s'
+        ))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{skipped} orders skipped: their status does not allow moving to {status}'
+            ))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{missing} order numbers not found'))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:02
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:02
+
+from django.db import migrations
+from django.db.models import Count, F, Sum
+
+CHUNK_SIZE = 500
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    last_id = 0
+    while True:
+        order_ids = list(Order.objects.filter(id__gt=last_id).order_by('id')
+                         .values_list('id', flat=True)[:CHUNK_SIZE])
+        if not order_ids:
+            break
+        totals = {
+            row['order']: row
+            for row in OrderItem.objects.filter(order__in=order_ids).values('order')
+            .annotate(count=Count('id'), total=Sum(F('price') * F('quantity')))
+            .order_by()
+        }
+        orders = [
+            Order(id=order_id,
+                  item_count=totals.get(order_id, {}).get('count', 0),
+                  total_cost=totals.get(order_id, {}).get('total') or 0)
+            for order_id in order_ids
+        ]
+        Order.objects.bulk_update(orders, ['item_count', 'total_cost'])
+        last_id = order_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_backfill_order_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:09
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_idempotency_key'),
+        ('products', '0005_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('is_preorder', models.BooleanField(default=False)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('units', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+                'ordering': ('-day', 'product'),
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'status', 'is_preorder'), name='unique_daily_sales')],
+            },
+        ),
+    ]
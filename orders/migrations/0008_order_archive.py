@@ -0,0 +1,69 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:17
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_admin_indexes'),
+        ('products', '0005_product_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='order',
+            options={},
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('first_name', models.CharField(max_length=50)),
+                ('last_name', models.CharField(max_length=50)),
+                ('email', models.EmailField(max_length=254)),
+                ('address', models.CharField(max_length=250)),
+                ('postal_code', models.CharField(max_length=20)),
+                ('city', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], default='pending', max_length=10)),
+                ('note', models.TextField(blank=True)),
+                ('total_cost', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('is_preorder', models.BooleanField(default=False)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created', '-id'], name='archived_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['-created', '-id'], name='archived_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='archived_email_lower_idx'),
+        ),
+    ]
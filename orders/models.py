@@ -1,8 +1,14 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Lower
 from products.models import Product
 from django.contrib.auth.models import User
 
-class Order(models.Model):
+class BaseOrder(models.Model):
+    """
+    Fields shared by placed orders and archived ones.
+    """
     ORDER_STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -11,7 +17,6 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     email = models.EmailField()
@@ -22,9 +27,13 @@ class Order(models.Model):
     updated = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10, choices=ORDER_STATUS_CHOICES, default='pending')
     note = models.TextField(blank=True)
-    
+    # Denormalized from the items so order lists need no per-order queries;
+    # set at checkout and by update_totals()
+    total_cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    item_count = models.PositiveIntegerField(default=0)
+
     class Meta:
-        ordering = ('-created',)
+        abstract = True
     
     def __str__(self):
         return f'Order {self.id}'
@@ -32,15 +41,121 @@ class Order(models.Model):
     def get_total_cost(self):
         return sum(item.get_cost() for item in self.items.all())
 
-class OrderItem(models.Model):
-    order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, related_name='order_items', on_delete=models.CASCADE)
+class OrderQuerySet(models.QuerySet):
+    def delete(self, keep_sales=False):
+        """
+        Delete the orders in bulk, taking their lines out of the daily
+        sales unless ``keep_sales`` (archived orders stay counted).
+
+        Done here rather than in a pre_delete receiver, which would make
+        Django load and signal every order one by one.
+        """
+        from . import sales
+
+        with transaction.atomic():
+            if not keep_sales:
+                sales.remove_orders(self.values('pk'))
+            return super().delete()
+
+
+class Order(BaseOrder):
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    # Token from the checkout form; a resubmission finds the order it created
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+    
+    class Meta:
+        # No default ordering: queries that need one say so and get it from
+        # an index instead of sorting the table
+        indexes = [
+            # Order history: a customer's orders, newest first; id breaks ties
+            # for the keyset pagination
+            models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+            # The admin order list and its date filter
+            models.Index(fields=['-created', '-id'], name='order_created_idx'),
+            # Admin search by email, case-insensitively
+            models.Index(Lower('email'), name='order_email_lower_idx'),
+        ]
+
+    def update_totals(self):
+        totals = self.items.aggregate(count=Count('id'), total=Sum(F('price') * F('quantity')))
+        self.item_count = totals['count']
+        self.total_cost = totals['total'] or Decimal('0')
+        self.save(update_fields=['item_count', 'total_cost', 'updated'])
+
+    def delete(self, *args, **kwargs):
+        from . import sales
+
+        with transaction.atomic():
+            # Before the items are deleted along with the order
+            sales.record_order(self, sign=-1)
+            return super().delete(*args, **kwargs)
+
+class BaseOrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
     is_preorder = models.BooleanField(default=False)
+
+    class Meta:
+        abstract = True
     
     def __str__(self):
         return str(self.id)
     
     def get_cost(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class OrderItem(BaseOrderItem):
+    order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='order_items', on_delete=models.CASCADE)
+
+class ArchivedOrder(BaseOrder):
+    """
+    A delivered or cancelled order moved out of Order by archive_orders,
+    keeping its id. Read-only; see orders.archive.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='archived_orders')
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='archived_user_created_idx'),
+            models.Index(fields=['-created', '-id'], name='archived_created_idx'),
+            models.Index(Lower('email'), name='archived_email_lower_idx'),
+        ]
+
+class ArchivedOrderItem(BaseOrderItem):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+
+class DailySales(models.Model):
+    """
+    Sales per day, product, order status and pre-order flag, kept up to
+    date as orders are placed and change status (see orders.sales) so
+    reports never have to add up the whole order history.
+    """
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=Order.ORDER_STATUS_CHOICES)
+    is_preorder = models.BooleanField(default=False)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    units = models.IntegerField(default=0)
+    # Order lines, i.e. the number of orders that included the product
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ('-day', 'product')
+        verbose_name_plural = 'daily sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'status', 'is_preorder'],
+                                    name='unique_daily_sales'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.product_id} {self.status}'
@@ -0,0 +1,81 @@
+"""
+Paginators for order listings.
+
+MergedKeysetPaginator pages through orders and their archive as one
+listing; its cursors are signed with a salt of their own, so they cannot
+be swapped with product listing cursors. EstimatedCountPaginator stops
+counting at a limit and falls back to the database's own row estimate
+beyond it.
+"""
+from functools import cmp_to_key, partial
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from products.pagination import KeysetPaginator
+
+CURSOR_SALT = 'orders.pagination.cursor'
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    Keyset pagination over several querysets with the same ordering
+    fields, such as a table and its archive, as if they were one. Each
+    page reads at most a page from each queryset and merges them.
+    """
+    cursor_salt = CURSOR_SALT
+
+    def __init__(self, querysets, ordering, per_page):
+        super().__init__(querysets[0], ordering, per_page)
+        self.querysets = querysets
+
+    def _compare(self, a, b, forward):
+        for field, descending in zip(self.fields, self.descending):
+            x, y = getattr(a, field), getattr(b, field)
+            if x != y:
+                result = -1 if x < y else 1
+                return -result if descending == forward else result
+        return 0
+
+    def fetch(self, values, forward):
+        rows = []
+        for queryset in self.querysets:
+            rows.extend(self.seek(values, forward, queryset)[:self.per_page + 1])
+        rows.sort(key=cmp_to_key(partial(self._compare, forward=forward)))
+        return rows[:self.per_page + 1]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that counts exactly only up to ``count_limit`` rows.
+
+    Past the limit an unfiltered PostgreSQL table reports the planner's
+    row estimate; otherwise the count stays at the limit, so the later
+    pages are reached by filtering rather than paging.
+    """
+
+    def __init__(self, *args, count_limit=10000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_limit = count_limit
+
+    def estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] > 0 else None
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        # COUNT(*) over a LIMIT subquery stops reading at the limit
+        count = self.object_list[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        return max(self.estimate() or 0, self.count_limit)
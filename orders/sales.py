@@ -0,0 +1,208 @@
+"""
+Daily sales aggregates.
+
+DailySales holds one row per day, product, order status and pre-order
+flag. Checkout adds the new order's lines; a status change moves the
+order's lines from the old status to the new one. Each change is one read
+of the affected rows and one bulk upsert. Bulk status changes and
+rebuild() group the order items in the database, so no per-item objects
+are built. Deleting orders takes their lines away (see Order.delete()).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrderItem, DailySales, OrderItem
+
+KEY_FIELDS = ['day', 'product', 'status', 'is_preorder']
+VALUE_FIELDS = ['revenue', 'units', 'orders']
+
+REPORT_GROUPS = {
+    'day': ['day'],
+    'product': ['product__name'],
+    'category': ['product__category__name'],
+    'status': ['status'],
+}
+
+
+def _new_deltas():
+    return defaultdict(lambda: [Decimal('0'), 0, 0])
+
+
+def add_items(deltas, order, items, status, sign=1):
+    """
+    Add (or with ``sign=-1`` take away) ``items`` of ``order`` counted
+    under ``status``.
+    """
+    day = timezone.localdate(order.created)
+    for item in items:
+        row = deltas[(day, item.product_id, status, item.is_preorder)]
+        row[0] += sign * item.price * item.quantity
+        row[1] += sign * item.quantity
+        row[2] += sign
+    return deltas
+
+
+def group_items(items):
+    """
+    Totals of ``items`` (an OrderItem queryset) per aggregate row, added up
+    in the database.
+    """
+    return (
+        items.annotate(day=TruncDate('order__created'))
+        .values('day', 'product_id', 'order__status', 'is_preorder')
+        .annotate(
+            revenue=Sum(F('price') * F('quantity'),
+                        output_field=DecimalField(max_digits=12, decimal_places=2)),
+            units=Sum('quantity'),
+            orders=Count('id'),
+        )
+        .order_by()
+    )
+
+
+def add_groups(deltas, groups, status=None, sign=1):
+    """
+    Add ``groups`` from group_items(), counted under their order's status
+    or under ``status`` when given.
+    """
+    for group in groups:
+        row = deltas[(group['day'], group['product_id'],
+                      status or group['order__status'], group['is_preorder'])]
+        row[0] += sign * group['revenue']
+        row[1] += sign * group['units']
+        row[2] += sign * group['orders']
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Add ``deltas``, a mapping of (day, product id, status, is_preorder) to
+    [revenue, units, orders], to the stored rows.
+    """
+    deltas = {key: values for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+    with transaction.atomic(savepoint=False):
+        # Locked so concurrent updates of the same rows apply one after
+        # the other
+        existing = {
+            (row.day, row.product_id, row.status, row.is_preorder): row
+            for row in DailySales.objects.select_for_update().filter(
+                day__in={key[0] for key in deltas},
+                product__in={key[1] for key in deltas},
+            ).order_by()
+        }
+        rows = []
+        for key, (revenue, units, orders) in deltas.items():
+            day, product_id, status, is_preorder = key
+            current = existing.get(key)
+            if current is not None:
+                revenue += current.revenue
+                units += current.units
+                orders += current.orders
+            rows.append(DailySales(day=day, product_id=product_id, status=status,
+                                   is_preorder=is_preorder, revenue=revenue,
+                                   units=units, orders=orders))
+        DailySales.objects.bulk_create(rows, update_conflicts=True, unique_fields=KEY_FIELDS,
+                                       update_fields=VALUE_FIELDS)
+        # Rows emptied by a status change are dropped rather than kept at zero
+        if any(row.orders <= 0 for row in rows):
+            DailySales.objects.filter(
+                day__in={key[0] for key in deltas}, orders__lte=0
+            ).delete()
+
+
+def record_order(order, items=None, sign=1):
+    """
+    Count ``order`` (its current items unless given) under its status.
+    """
+    if items is None:
+        items = order.items.only('product', 'price', 'quantity', 'is_preorder')
+    apply_deltas(add_items(_new_deltas(), order, items, order.status, sign))
+
+
+def move_order(order, old_status, new_status):
+    """
+    Move the lines of ``order`` from ``old_status`` to ``new_status``.
+    """
+    items = list(order.items.only('product', 'price', 'quantity', 'is_preorder'))
+    deltas = add_items(_new_deltas(), order, items, old_status, -1)
+    apply_deltas(add_items(deltas, order, items, new_status))
+
+
+def move_orders(order_ids, new_status):
+    """
+    Move the lines of the given orders from their current status to
+    ``new_status``, in one grouped read; call it before the orders are
+    updated.
+    """
+    groups = list(group_items(OrderItem.objects.filter(order__in=order_ids)))
+    deltas = add_groups(_new_deltas(), groups, sign=-1)
+    apply_deltas(add_groups(deltas, groups, status=new_status))
+
+
+def remove_orders(order_ids):
+    """
+    Take the lines of the given orders away, in one grouped read; call it
+    before the orders are deleted.
+    """
+    groups = group_items(OrderItem.objects.filter(order__in=order_ids))
+    apply_deltas(add_groups(_new_deltas(), groups, sign=-1))
+
+
+def rebuild(since=None, chunk_size=5000):
+    """
+    Recompute the rows from the order history, for orders placed on or
+    after ``since`` (a date) or all of them, reading the items in chunks.
+    Returns the number of rows written.
+
+    Runs in one transaction so the rows are never seen half rebuilt; run
+    it when orders are not changing status, as those moves can race with
+    the rebuild.
+    """
+    stale = DailySales.objects.all()
+    if since is not None:
+        stale = stale.filter(day__gte=since)
+
+    totals = _new_deltas()
+    with transaction.atomic():
+        stale.delete()
+        # Archived orders count as much as placed ones
+        for model in (OrderItem, ArchivedOrderItem):
+            items = model.objects.all()
+            if since is not None:
+                items = items.filter(order__created__date__gte=since)
+            bounds = items.aggregate(first=Min('id'), last=Max('id'))
+            if bounds['first'] is None:
+                continue
+            for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+                add_groups(totals, group_items(items.filter(id__gte=start, id__lt=start + chunk_size)))
+        DailySales.objects.bulk_create([
+            DailySales(day=day, product_id=product_id, status=status, is_preorder=is_preorder,
+                       revenue=revenue, units=units, orders=orders)
+            for (day, product_id, status, is_preorder), (revenue, units, orders) in totals.items()
+        ], batch_size=1000)
+    return len(totals)
+
+
+def report(by='day', since=None, until=None, statuses=None, queryset=None):
+    """
+    Revenue, units and orders from the stored rows, grouped by day,
+    product, category or status.
+    """
+    rows = queryset if queryset is not None else DailySales.objects.all()
+    if since is not None:
+        rows = rows.filter(day__gte=since)
+    if until is not None:
+        rows = rows.filter(day__lte=until)
+    if statuses:
+        rows = rows.filter(status__in=statuses)
+    fields = REPORT_GROUPS[by]
+    return (rows.values(*fields)
+            .annotate(revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders'))
+            .order_by(*fields))
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from outbox import events
+
+from . import sales
+from .models import Order
+
+
+@receiver(pre_save, sender=Order)
+def remember_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Read from the database rather than kept from when the instance was
+    # loaded, which misses earlier saves, update() calls and other processes
+    instance._saved_status = None
+    if raw or instance._state.adding or (update_fields is not None and 'status' not in update_fields):
+        return
+    instance._saved_status = (Order.objects.filter(pk=instance.pk)
+                              .values_list('status', flat=True).first())
+
+
+@receiver(post_save, sender=Order)
+def move_sales_on_status_change(sender, instance, created, raw=False, **kwargs):
+    old_status = instance.__dict__.pop('_saved_status', None)
+    # New orders are counted by checkout once their items exist
+    if created or raw or old_status is None or old_status == instance.status:
+        return
+    sales.move_order(instance, old_status, instance.status)
+    events.enqueue('order.status_changed',
+                   {'order_id': instance.pk, 'from': old_status, 'to': instance.status})
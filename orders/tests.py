@@ -1,9 +1,33 @@
-from django.test import TestCase
-from django.urls import reverse
+import csv
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.cart import CartLine
+from outbox.models import OutboxMessage
 from products.models import Category, Product
-from .models import Order, OrderItem
-from decimal import Decimal
+from products.pagination import InvalidCursor, KeysetPaginator
+
+from . import archive, sales, transitions
+from .checkout import OutOfStock, place_order
+from .models import ArchivedOrder, ArchivedOrderItem, DailySales, Order, OrderItem
+from .pagination import EstimatedCountPaginator, MergedKeysetPaginator
+
 
 class OrderModelTest(TestCase):
     def setUp(self):
@@ -58,6 +82,22 @@ class OrderModelTest(TestCase):
         expected_cost = Decimal('99.99') * 2
         self.assertEqual(self.order.get_total_cost(), expected_cost)
     
+    def test_update_totals(self):
+        OrderItem.objects.create(order=self.order, product=self.product, price=Decimal('5.00'), quantity=3)
+        self.order.update_totals()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.item_count, self.order.total_cost), (2, Decimal('214.98')))
+
+    def test_backfill_migration(self):
+        backfill = import_module('orders.migrations.0003_backfill_order_totals')
+        Order.objects.create(first_name='No', last_name='Items', email='n@example.com',
+                                     address='1 St', postal_code='1', city='City')
+        backfill.backfill_order_totals(apps, None)
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list('item_count', 'total_cost')),
+            [(1, Decimal('199.98')), (0, Decimal('0'))]
+        )
+    
     def test_order_item_creation(self):
         self.assertEqual(self.order_item.product, self.product)
         self.assertEqual(self.order_item.price, Decimal('99.99'))
@@ -145,6 +185,44 @@ class OrderViewsTest(TestCase):
         self.assertEqual(new_order.first_name, 'John')
         self.assertEqual(new_order.last_name, 'Doe')
     
+    def test_order_create_revalidates_cart(self):
+        self.client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 3, 'override': False}
+        )
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('89.99'), stock=2)
+        order_data = {
+            'first_name': 'John',
+            'last_name': 'Doe',
+            'email': 'john@example.com',
+            'address': '123 Main St',
+            'postal_code': '54321',
+            'city': 'New City'
+        }
+
+        # The first attempt only reports the changes
+        response = self.client.post(reverse('orders:order_create'), order_data)
+        self.assertTemplateUsed(response, 'orders/order_create.html')
+        self.assertContains(response, 'changed from $99.99 to $89.99')
+        self.assertContains(response, 'Only 2 of Test Product left in stock')
+        self.assertFalse(Order.objects.filter(email='john@example.com').exists())
+
+        response = self.client.post(reverse('orders:order_create'), order_data)
+        self.assertTemplateUsed(response, 'orders/order_created.html')
+        item = Order.objects.get(email='john@example.com').items.get()
+        self.assertEqual((item.price, item.quantity), (Decimal('89.99'), 2))
+
+    def test_order_create_drops_unavailable_products(self):
+        self.client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 1, 'override': False}
+        )
+        Product.objects.filter(pk=self.product.pk).update(available=False)
+        response = self.client.get(reverse('orders:order_create'))
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Test Product is no longer available')
+    
     def test_order_history_view(self):
         self.client.login(username='testuser', password='testpassword')
         response = self.client.get(reverse('orders:order_history'))
@@ -160,4 +238,510 @@ class OrderViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'orders/order_detail.html')
         self.assertContains(response, 'Test Product')
-        self.assertContains(response, '99.99')
\ No newline at end of file
+        self.assertContains(response, '99.99')
+
+class PlaceOrderTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=5)
+        self.coat = Product.objects.create(category=category, name='Coat', slug='coat',
+                                           price=Decimal('150.00'), stock=0, is_preorder=True)
+
+    def order(self):
+        return Order(first_name='John', last_name='Doe', email='john@example.com',
+                     address='123 Main St', postal_code='54321', city='New City')
+
+    def test_stock_is_taken_and_items_created(self):
+        # Order insert, a stock update per in-stock line, one items insert,
+        # the daily sales read and upsert and the outbox message, inside a
+        # savepoint
+        with self.assertNumQueries(8):
+            order = place_order(self.order(), [CartLine(self.shirt, 2, 2000), CartLine(self.coat, 1, 15000)])
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 3)
+        self.assertEqual(sorted(order.items.values_list('product__name', 'quantity', 'is_preorder')),
+                         [('Coat', 1, True), ('Shirt', 2, False)])
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total_cost), (2, Decimal('190.00')))
+
+    def test_short_stock_rolls_back_everything(self):
+        hat = Product.objects.create(category=self.shirt.category, name='Hat', slug='hat',
+                                     price=Decimal('5.00'), stock=1)
+        order = self.order()
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(order, [CartLine(self.shirt, 2, 2000), CartLine(hat, 3, 500)])
+        self.assertEqual(raised.exception.messages, ['Only 1 of Hat left in stock; you asked for 3.'])
+        self.assertIsNone(order.pk)
+        self.assertFalse(Order.objects.exists())
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 5)
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    def test_parallel_checkouts_never_oversell(self):
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        product = Product.objects.create(category=category, name='Sneaker', slug='sneaker',
+                                         price=Decimal('80.00'), stock=5)
+        results = []
+
+        def checkout(index):
+            order = Order(first_name='Buyer', last_name=str(index), email=f'buyer{index}@example.com',
+                          address='1 Street', postal_code='1000', city='City')
+            try:
+                # SQLite allows one writer at a time, so retry when locked
+                for _ in range(50):
+                    try:
+                        place_order(order, [CartLine(product, 1, 8000)])
+                        results.append('ok')
+                        return
+                    except OperationalError:
+                        order.pk = None
+                        order._state.adding = True
+                        time.sleep(0.01)
+                results.append('locked')
+            except OutOfStock:
+                results.append('sold out')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count('ok'), 5)
+        self.assertEqual(results.count('sold out'), 15)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(OrderItem.objects.count(), 5)
+
+
+class OrderHistoryQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpassword')
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        self.products = [
+            Product.objects.create(category=category, name=f'Product {n}', slug=f'product-{n}',
+                                   price=Decimal('10.00'), stock=100)
+            for n in range(10)
+        ]
+        self.client.force_login(self.user)
+        # Warm the category menu cache shared by every page
+        self.client.get(reverse('orders:order_history'))
+
+    def create_orders(self, count, items_per_order=2):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, first_name='A', last_name='B',
+                                         email='buyer@example.com', address='1 St',
+                                         postal_code='1', city='City')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, price=product.price, quantity=1)
+                for product in self.products[:items_per_order]
+            ])
+            order.update_totals()
+        return order
+
+    def test_history_queries_do_not_grow_with_orders(self):
+        self.create_orders(3)
+        # session, user, summary aggregate and page of orders from both the
+        # orders and the archive, cart badge
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('orders:order_history'))
+        self.assertContains(response, '3 orders placed, $60.00 in total')
+
+        self.create_orders(40)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('orders:order_history'))
+        self.assertEqual(len(response.context['orders']), 20)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('orders:order_history'),
+                                       {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(response.context['orders']), 20)
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+    def test_detail_queries_do_not_grow_with_items(self):
+        small = self.create_orders(1, items_per_order=1)
+        large = self.create_orders(1, items_per_order=10)
+        for order in (small, large):
+            # session, user, order, items with their products, cart badge
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('orders:order_detail', args=[order.id]))
+            self.assertContains(response, 'Product 0')
+
+
+class IdempotentCheckoutTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        self.product = Product.objects.create(category=category, name='Test Product',
+                                              slug='test-product', price=Decimal('25.00'), stock=10)
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]),
+                         {'quantity': 2, 'override': False})
+        response = self.client.get(reverse('orders:order_create'))
+        self.order_data = {
+            'first_name': 'John',
+            'last_name': 'Doe',
+            'email': 'john@example.com',
+            'address': '123 Main St',
+            'postal_code': '54321',
+            'city': 'New City',
+            'idempotency_key': response.context['form'].initial['idempotency_key'],
+        }
+
+    def test_replayed_submission_returns_original_order(self):
+        first = self.client.post(reverse('orders:order_create'), self.order_data)
+        # The session and the existing order
+        with self.assertNumQueries(2):
+            second = self.client.post(reverse('orders:order_create'), self.order_data)
+        self.assertTemplateUsed(second, 'orders/order_created.html')
+        self.assertEqual(second.context['order'], first.context['order'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+    def test_concurrent_duplicate_is_resolved_to_existing_order(self):
+        existing = Order.objects.create(first_name='John', last_name='Doe', email='john@example.com',
+                                        address='123 Main St', postal_code='54321', city='New City',
+                                        idempotency_key=self.order_data['idempotency_key'])
+        # The duplicate passes the initial lookup, then loses on the unique key
+        with mock.patch('orders.views.Order.objects.filter', wraps=Order.objects.filter) as lookup:
+            lookup.return_value.first.side_effect = [None, existing]
+            response = self.client.post(reverse('orders:order_create'), self.order_data)
+        self.assertEqual(response.context['order'], existing)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+    def test_key_of_another_shopper_places_a_new_order(self):
+        first = self.client.post(reverse('orders:order_create'), self.order_data)
+
+        # An anonymous shopper in another session reusing the key
+        other = self.client_class()
+        other.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1, 'override': False})
+        response = other.post(reverse('orders:order_create'), self.order_data)
+        self.assertNotEqual(response.context['order'], first.context['order'])
+        self.assertIsNone(response.context['order'].idempotency_key)
+
+        # A signed-in customer reusing it
+        user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        self.client.force_login(user)
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1, 'override': False})
+        response = self.client.post(reverse('orders:order_create'), self.order_data)
+        self.assertNotEqual(response.context['order'], first.context['order'])
+        self.assertEqual(response.context['order'].user, user)
+
+        self.assertEqual(Order.objects.count(), 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 6)
+
+
+class DailySalesTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=50)
+        self.coat = Product.objects.create(category=category, name='Coat', slug='coat',
+                                           price=Decimal('150.00'), stock=0, is_preorder=True)
+
+    def place(self, *lines):
+        order = Order(first_name='John', last_name='Doe', email='john@example.com',
+                      address='123 Main St', postal_code='54321', city='New City')
+        return place_order(order, [CartLine(product, quantity, int(product.price * 100))
+                                   for product, quantity in lines])
+
+    def rows(self):
+        return sorted(DailySales.objects.values_list('product__name', 'status', 'is_preorder',
+                                                     'revenue', 'units', 'orders'))
+
+    def test_checkout_and_status_changes_update_aggregates(self):
+        first = self.place((self.shirt, 2), (self.coat, 1))
+        self.place((self.shirt, 1))
+        self.assertEqual(self.rows(), [
+            ('Coat', 'pending', True, Decimal('150.00'), 1, 1),
+            ('Shirt', 'pending', False, Decimal('60.00'), 3, 2),
+        ])
+
+        first = Order.objects.get(pk=first.pk)
+        first.status = 'shipped'
+        first.save()
+        self.assertEqual(self.rows(), [
+            ('Coat', 'shipped', True, Decimal('150.00'), 1, 1),
+            ('Shirt', 'pending', False, Decimal('20.00'), 1, 1),
+            ('Shirt', 'shipped', False, Decimal('40.00'), 2, 1),
+        ])
+
+        first.delete()
+        self.assertEqual(self.rows(), [('Shirt', 'pending', False, Decimal('20.00'), 1, 1)])
+
+        Order.objects.all().delete()
+        self.assertEqual(self.rows(), [])
+
+    def test_status_changes_are_compared_with_the_stored_status(self):
+        order = self.place((self.shirt, 2))
+        # Saved twice on the same instance
+        order.status = 'shipped'
+        order.save()
+        order.status = 'delivered'
+        order.save()
+        self.assertEqual(self.rows(), [('Shirt', 'delivered', False, Decimal('40.00'), 2, 1)])
+
+        # Changed behind the instance's back, then saved again
+        sales.move_orders([order.pk], 'cancelled')
+        Order.objects.filter(pk=order.pk).update(status='cancelled')
+        order.status = 'pending'
+        order.save()
+        self.assertEqual(self.rows(), [('Shirt', 'pending', False, Decimal('40.00'), 2, 1)])
+
+        order.refresh_from_db()
+        order.status = 'processing'
+        order.save(update_fields=['status'])
+        self.assertEqual(self.rows(), [('Shirt', 'processing', False, Decimal('40.00'), 2, 1)])
+
+    def test_rebuild_matches_incremental_updates(self):
+        self.place((self.shirt, 2), (self.coat, 1))
+        order = self.place((self.shirt, 3))
+        order.status = 'cancelled'
+        order.save()
+        expected = self.rows()
+
+        DailySales.objects.all().delete()
+        call_command('rebuild_daily_sales', '--chunk-size=1', stdout=StringIO())
+        self.assertEqual(self.rows(), expected)
+
+    def test_sales_report_reads_aggregates(self):
+        self.place((self.shirt, 2), (self.coat, 1))
+        cancelled = self.place((self.shirt, 5))
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('sales_report', '--by=product', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ['Coat', '150.00', '1', '1'])
+        self.assertEqual(lines[2].split(), ['Shirt', '40.00', '2', '1'])
+
+    def test_admin_shows_category_totals(self):
+        self.place((self.shirt, 2))
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:orders_dailysales_changelist'))
+        self.assertEqual(list(response.context['category_totals']),
+                         [{'product__category__name': 'Shirts', 'revenue': Decimal('40.00'),
+                           'units': 2, 'orders': 1}])
+
+class OrderAdminTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=50)
+        self.orders = []
+        for n in range(3):
+            order = Order(first_name='John', last_name='Doe', email=f'john{n}@example.com',
+                          address='123 Main St', postal_code='54321', city='New City')
+            self.orders.append(place_order(order, [CartLine(self.shirt, n + 1, 2000)]))
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.url = reverse('admin:orders_order_changelist')
+
+    def test_export_streams_items_as_csv(self):
+        response = self.client.post(self.url, {
+            'action': 'export_csv',
+            '_selected_action': [order.pk for order in self.orders[:2]],
+        })
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['order_id', 'created', 'status'])
+        self.assertEqual([(row[0], row[5], row[13], row[14]) for row in rows[1:]], [
+            (str(self.orders[0].pk), 'john0@example.com', '1', '20.00'),
+            (str(self.orders[1].pk), 'john1@example.com', '2', '40.00'),
+        ])
+
+    def test_export_keeps_empty_orders_and_defuses_formulas(self):
+        empty = Order.objects.create(first_name='=HYPERLINK("http://evil.example")', last_name='-2+3',
+                                     email='@example.com', address='123 Main St',
+                                     postal_code='54321', city='New City')
+        response = self.client.post(self.url, {
+            'action': 'export_csv',
+            '_selected_action': [self.orders[0].pk, empty.pk],
+        })
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][3], 'John')
+        self.assertEqual(rows[2][:6], [str(empty.pk), rows[2][1], 'pending',
+                                       '\'=HYPERLINK("http://evil.example")', "'-2+3", "'@example.com"])
+        self.assertEqual(rows[2][10:], [''] * 6)
+
+    def test_search_by_order_number_and_email(self):
+        response = self.client.get(self.url, {'q': f'#{self.orders[1].pk}'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.orders[1]])
+        response = self.client.get(self.url, {'q': 'John2@Example.com'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.orders[2]])
+
+    def test_paginator_count_stops_at_limit(self):
+        orders = Order.objects.order_by('-created', '-id')
+        paginator = EstimatedCountPaginator(orders, 1, count_limit=2)
+        self.assertEqual(paginator.count, 2)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(EstimatedCountPaginator(orders, 1).count, 3)
+
+class OrderTransitionTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=50)
+        self.orders = []
+        for status in ['processing', 'processing', 'pending', 'processing']:
+            order = Order(first_name='John', last_name='Doe', email='john@example.com',
+                          address='123 Main St', postal_code='54321', city='New City')
+            place_order(order, [CartLine(self.shirt, 1, 2000)])
+            Order.objects.filter(pk=order.pk).update(status=status)
+            self.orders.append(order)
+        sales.rebuild()
+        OutboxMessage.objects.all().delete()
+
+    def test_allowed_orders_move_in_batches(self):
+        # Per batch: the orders, their grouped items, the daily sales read,
+        # upsert and cleanup, the UPDATE and the outbox insert, in a savepoint
+        with self.assertNumQueries(20):
+            moved, skipped = transitions.transition(Order.objects.all(), 'shipped', batch_size=2)
+        self.assertEqual((moved, skipped), (3, 1))
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('status', flat=True)),
+                         ['shipped', 'shipped', 'pending', 'shipped'])
+        self.assertEqual(sorted(OutboxMessage.objects.values_list('payload__order_id', flat=True)),
+                         sorted(self.orders[n].pk for n in (0, 1, 3)))
+        self.assertEqual(dict(DailySales.objects.values_list('status', 'orders')),
+                         {'pending': 1, 'shipped': 3})
+
+    def test_unknown_status_is_rejected(self):
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(Order.objects.all(), 'lost')
+
+    def test_shipping_email_is_sent_by_the_worker(self):
+        transitions.transition(Order.objects.filter(pk=self.orders[0].pk), 'shipped')
+        call_command('process_outbox', '--concurrency=1', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject,
+                         f'Your HK Fashion order #{self.orders[0].pk} is on its way')
+
+    def test_command_reads_order_numbers_from_file(self):
+        ids_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        self.addCleanup(os.remove, ids_file.name)
+        with ids_file:
+            ids_file.write(f'#{self.orders[0].pk}\n{self.orders[2].pk}\n\n99999\n')
+        out = StringIO()
+        call_command('transition_orders', 'shipped', f'--ids-file={ids_file.name}', stdout=out)
+        self.assertIn('1 orders marked as shipped', out.getvalue())
+        self.assertIn('1 orders skipped', out.getvalue())
+        self.assertIn('1 order numbers not found', out.getvalue())
+
+    def test_admin_action(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'mark_cancelled',
+            '_selected_action': [order.pk for order in self.orders],
+        }, follow=True)
+        self.assertContains(response, '4 orders marked as cancelled.')
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'cancelled'})
+
+
+class OrderArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpassword')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.shirt = Product.objects.create(category=category, name='Shirt', slug='shirt',
+                                            price=Decimal('20.00'), stock=100)
+        self.orders = []
+        now = timezone.now()
+        # Oldest first; every other order is an old delivered one
+        for n in range(30):
+            order = Order(user=self.user, first_name='John', last_name='Doe',
+                          email='john@example.com', address='123 Main St',
+                          postal_code='54321', city='New City')
+            place_order(order, [CartLine(self.shirt, 1, 2000)])
+            status = 'delivered' if n % 2 == 0 and n < 20 else 'pending'
+            Order.objects.filter(pk=order.pk).update(status=status,
+                                                     created=now - timedelta(days=800 - n))
+            self.orders.append(order)
+        sales.rebuild()
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_orders', *args, stdout=out)
+        return out.getvalue()
+
+    def test_old_finished_orders_are_moved_in_chunks(self):
+        sales_before = sorted(DailySales.objects.values_list('day', 'status', 'orders'))
+        output = self.archive('--chunk-size=4', '--limit=6')
+        self.assertIn('4 orders archived', output)
+        self.assertIn('Archived 6 orders', output)
+        # Resuming picks up where the last run stopped
+        self.assertIn('Archived 4 orders', self.archive('--chunk-size=4'))
+        self.assertIn('Archived 0 orders', self.archive())
+
+        archived_ids = {self.orders[n].pk for n in range(0, 20, 2)}
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat=True)), archived_ids)
+        self.assertEqual(set(ArchivedOrderItem.objects.values_list('order_id', flat=True)), archived_ids)
+        self.assertFalse(Order.objects.filter(pk__in=archived_ids).exists())
+        self.assertEqual(OrderItem.objects.count(), 20)
+        self.assertEqual(sorted(DailySales.objects.values_list('day', 'status', 'orders')), sales_before)
+        sales.rebuild()
+        self.assertEqual(sorted(DailySales.objects.values_list('day', 'status', 'orders')), sales_before)
+
+    def test_chunk_queries_do_not_grow_with_its_size(self):
+        old = list(archive.archivable().order_by('pk').values_list('pk', flat=True))
+        # Read the orders, copy them and their items, then read the order
+        # rows the delete collects and delete the items and orders, in two
+        # savepoints
+        with self.assertNumQueries(11):
+            self.assertEqual(archive.archive_chunk(old[:2]), 2)
+        with self.assertNumQueries(11):
+            self.assertEqual(archive.archive_chunk(old[2:]), 8)
+
+    def test_product_listing_cursors_are_not_accepted(self):
+        ordering = ('-created', '-id')
+        orders = Order.objects.filter(user=self.user)
+        cursor = KeysetPaginator(orders, ordering, 5).page().next_cursor
+        merged = MergedKeysetPaginator([orders, ArchivedOrder.objects.all()], ordering, 5)
+        with self.assertRaises(InvalidCursor):
+            merged.page(cursor)
+        self.assertEqual(len(merged.page(merged.page().next_cursor)), 5)
+
+    def test_history_and_detail_include_archived_orders(self):
+        self.archive()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('orders:order_history'))
+        self.assertContains(response, '30 orders placed, $600.00 in total')
+        newest_first = [order.pk for order in reversed(self.orders)]
+        self.assertEqual([order.pk for order in response.context['orders']], newest_first[:20])
+        response = self.client.get(reverse('orders:order_history'),
+                                   {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([order.pk for order in response.context['orders']], newest_first[20:])
+        response = self.client.get(reverse('orders:order_history'),
+                                   {'cursor': response.context['page_obj'].previous_cursor})
+        self.assertEqual([order.pk for order in response.context['orders']], newest_first[:20])
+
+        response = self.client.get(reverse('orders:order_detail', args=[self.orders[0].pk]))
+        self.assertIsInstance(response.context['order'], ArchivedOrder)
+        self.assertContains(response, 'Shirt')
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.client.force_login(other)
+        response = self.client.get(reverse('orders:order_detail', args=[self.orders[0].pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_admin_search_points_to_archive(self):
+        self.archive()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:orders_order_changelist'),
+                                   {'q': str(self.orders[0].pk)})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+        self.assertContains(response, 'Archived orders also match.')
+        response = self.client.get(reverse('admin:orders_archivedorder_changelist'),
+                                   {'q': str(self.orders[0].pk)})
+        self.assertEqual([order.pk for order in response.context['cl'].result_list], [self.orders[0].pk])
+        response = self.client.get(reverse('admin:orders_archivedorder_change', args=[self.orders[0].pk]))
+        self.assertEqual(response.status_code, 200)
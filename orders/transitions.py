@@ -0,0 +1,69 @@
+"""
+Moving orders between statuses in bulk.
+
+transition() walks the selected orders by primary key in batches. Each
+batch is one transaction: the orders that may move are locked and read
+(ids and statuses only), moved with a single UPDATE, their daily sales
+moved with them, and an 'order.status_changed' outbox message recorded
+per order. Orders whose status does not allow the move are skipped.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from outbox import events
+
+from . import sales
+from .models import Order
+
+ALLOWED_TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def sources(status):
+    """
+    The statuses an order can be moved to ``status`` from.
+    """
+    if status not in ALLOWED_TRANSITIONS:
+        raise InvalidTransition(f'Unknown order status {status!r}')
+    return {source for source, targets in ALLOWED_TRANSITIONS.items() if status in targets}
+
+
+def transition(orders, status, batch_size=500):
+    """
+    Move the orders in the ``orders`` queryset that are allowed to go to
+    ``status``. Returns (moved, skipped) counts.
+    """
+    allowed = sources(status)
+    moved = skipped = 0
+    last_pk = 0
+    more = True
+    while more:
+        with transaction.atomic():
+            batch = list(
+                orders.select_for_update().filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', 'status')[:batch_size]
+            )
+            more = len(batch) == batch_size
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            eligible = [(pk, old) for pk, old in batch if old in allowed]
+            skipped += len(batch) - len(eligible)
+            if not eligible:
+                continue
+            ids = [pk for pk, _ in eligible]
+            sales.move_orders(ids, status)
+            moved += Order.objects.filter(pk__in=ids).update(status=status, updated=timezone.now())
+            events.enqueue_many('order.status_changed', (
+                {'order_id': pk, 'from': old, 'to': status} for pk, old in eligible
+            ))
+    return moved, skipped
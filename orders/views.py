@@ -1,36 +1,90 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import secrets
+from decimal import Decimal
+
+from django.shortcuts import render, redirect
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .models import OrderItem, Order
+from django.db import IntegrityError
+from django.db.models import Count, Sum
+from . import archive
+from .checkout import OutOfStock, place_order
+from .models import Order
 from .forms import OrderCreateForm
-from cart.cart import Cart
+from .pagination import MergedKeysetPaginator
+from cart.cart import get_cart
 from django.urls import reverse
+from products.pagination import InvalidCursor
+
+ORDERS_PER_PAGE = 20
+ORDER_HISTORY_ORDERING = ('-created', '-id')
+
+# Idempotency keys handed to an anonymous shopper's checkout forms, so only
+# their session can replay the orders placed with them
+ISSUED_KEYS_SESSION_KEY = 'order_keys'
+MAX_ISSUED_KEYS = 10
+
+
+def _placed_by(request, order):
+    """
+    Whether ``order`` was placed by the shopper making ``request``.
+    """
+    if request.user.is_authenticated:
+        return order.user_id == request.user.pk
+    return (order.user_id is None
+            and order.idempotency_key in request.session.get(ISSUED_KEYS_SESSION_KEY, []))
+
 
 def order_create(request):
-    cart = Cart(request)
+    # A replayed submission (double click, refresh, client retry) gets the
+    # order it already created; this comes first because that order
+    # emptied the cart
+    idempotency_key = request.POST.get('idempotency_key') if request.method == 'POST' else None
+    if idempotency_key:
+        order = Order.objects.filter(idempotency_key=idempotency_key).first()
+        if order is not None:
+            if _placed_by(request, order):
+                return render(request, 'orders/order_created.html', {'order': order})
+            # Someone else's key never shows their order; the submission is
+            # placed as a new order without a key
+            idempotency_key = None
+
+    cart = get_cart(request)
     if len(cart) == 0:
         return redirect('products:product_list')
+
+    # Bring prices, availability and stock up to date in one query; the
+    # shopper reviews any changes before the order can be placed
+    changes = cart.revalidate()
+    for message in changes:
+        messages.warning(request, message)
+    if len(cart) == 0:
+        return redirect('cart:cart_detail')
         
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
-        if form.is_valid():
+        if form.is_valid() and not changes:
             order = form.save(commit=False)
             if request.user.is_authenticated:
                 order.user = request.user
-            order.save()
-            
-            for item in cart:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    price=item['price'],
-                    quantity=item['quantity'],
-                    is_preorder=item['product'].is_preorder
-                )
-            
-            # Clear the cart
-            cart.clear()
-            
-            return render(request, 'orders/order_created.html', {'order': order})
+            order.idempotency_key = idempotency_key or None
+            try:
+                place_order(order, cart)
+            except OutOfStock as exc:
+                # Nothing was saved; the next attempt adjusts the cart
+                for message in exc.messages:
+                    messages.error(request, message)
+            except IntegrityError:
+                # A concurrent copy of this submission won the race
+                existing = (order.idempotency_key
+                            and Order.objects.filter(idempotency_key=order.idempotency_key).first())
+                if not existing or not _placed_by(request, existing):
+                    raise
+                return render(request, 'orders/order_created.html', {'order': existing})
+            else:
+                # Clear the cart
+                cart.clear()
+
+                return render(request, 'orders/order_created.html', {'order': order})
     else:
         # Pre-fill the form with user data if authenticated
         initial_data = {}
@@ -51,16 +105,40 @@ def order_create(request):
                 if profile.postal_code:
                     initial_data['postal_code'] = profile.postal_code
                     
+        initial_data['idempotency_key'] = secrets.token_urlsafe(32)
+        if not request.user.is_authenticated:
+            issued = request.session.get(ISSUED_KEYS_SESSION_KEY, [])[-(MAX_ISSUED_KEYS - 1):]
+            request.session[ISSUED_KEYS_SESSION_KEY] = issued + [initial_data['idempotency_key']]
         form = OrderCreateForm(initial=initial_data)
     
     return render(request, 'orders/order_create.html', {'cart': cart, 'form': form})
 
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user)
-    return render(request, 'orders/order_history.html', {'orders': orders})
+    placed, archived = archive.history_querysets(request.user)
+    # Lifetime totals from the stored order totals, one query per table
+    summary = {'order_count': 0, 'total_spent': Decimal('0')}
+    for orders in (placed, archived):
+        totals = orders.aggregate(order_count=Count('id'), total_spent=Sum('total_cost'))
+        summary['order_count'] += totals['order_count']
+        summary['total_spent'] += totals['total_spent'] or Decimal('0')
+
+    # Pages follow a cursor rather than an offset, so even customers with
+    # thousands of orders get every page at the same cost; archived orders
+    # are merged in as if they were never moved
+    paginator = MergedKeysetPaginator([placed, archived], ORDER_HISTORY_ORDERING, ORDERS_PER_PAGE)
+    try:
+        page_obj = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page_obj = paginator.page()
+
+    return render(request, 'orders/order_history.html', {
+        'orders': page_obj.object_list,
+        'page_obj': page_obj,
+        'summary': summary,
+    })
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    return render(request, 'orders/order_detail.html', {'order': order})
\ No newline at end of file
+    order = archive.find_order(request.user, order_id)
+    return render(request, 'orders/order_detail.html', {'order': order})
@@ -0,0 +1,17 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import OutboxMessage
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'topic', 'status', 'attempts', 'available_at', 'created', 'processed_at']
+    list_filter = ['status', 'topic']
+    readonly_fields = ['topic', 'payload', 'attempts', 'last_error', 'created', 'processed_at']
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected messages now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=OutboxMessage.DONE).update(
+            status=OutboxMessage.PENDING, attempts=0, available_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} messages will be retried.')
@@ -0,0 +1,54 @@
+"""
+Recording and handling outbox messages.
+
+Code that changes data calls enqueue() inside its transaction, so the
+message is stored if and only if the change is:
+
+    with transaction.atomic():
+        order.save()
+        events.enqueue('order.created', {'order_id': order.pk})
+
+Apps register what to do with a topic in their handlers.py module:
+
+    @events.handler('order.created')
+    def send_order_confirmation(payload):
+        ...
+
+Handlers run later in the process_outbox worker and may run more than once
+(a worker can stop after a handler succeeded but before it was marked
+done), so they should be safe to repeat.
+"""
+from .models import OutboxMessage
+
+HANDLERS = {}
+
+
+def handler(topic):
+    """
+    Register the decorated function as the handler of ``topic``.
+    """
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, payload):
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def enqueue_many(topic, payloads, batch_size=500):
+    """
+    Record one message per payload with batched INSERTs. ``payloads`` may
+    be any iterable, so callers can stream them.
+    """
+    batch = []
+    count = 0
+    for payload in payloads:
+        batch.append(OutboxMessage(topic=topic, payload=payload))
+        if len(batch) >= batch_size:
+            OutboxMessage.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    OutboxMessage.objects.bulk_create(batch)
+    return count + len(batch)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from outbox.worker import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Run the handlers of pending outbox messages (emails and other side effects)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Messages claimed at a time')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Handlers run in parallel')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new messages instead of exiting when done')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        totals = [0, 0, 0]
+        while True:
+            counts = process_batch(options['batch_size'], options['concurrency'])
+            totals = [total + count for total, count in zip(totals, counts)]
+            if any(counts):
+                self.stdout.write('{} sent, {} to retry, {} failed'.format(*counts))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Done: {} sent, {} to retry, {} failed'.format(*totals)))
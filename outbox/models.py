@@ -0,0 +1,41 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxMessage(models.Model):
+    """
+    A side effect (email, notification, ...) to run after the transaction
+    that recorded it has committed. Written in the same transaction as the
+    change it belongs to and processed by the process_outbox command.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not picked up before this time: pushed back while a worker holds the
+    # message and after each failed attempt
+    available_at = models.DateTimeField(default=timezone.now)
+    lock_token = models.CharField(max_length=32, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('available_at', 'id')
+        indexes = [
+            # Workers only ever look for pending messages that are due
+            models.Index(fields=['available_at', 'id'], name='outbox_pending_idx',
+                         condition=models.Q(status='pending')),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} #{self.pk}'
@@ -0,0 +1,99 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import Category, Product
+
+from . import events, worker
+from .models import OutboxMessage
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        events.HANDLERS['test.echo'] = self.calls.append
+
+    def tearDown(self):
+        events.HANDLERS.pop('test.echo', None)
+        events.HANDLERS.pop('test.broken', None)
+
+    def test_message_is_rolled_back_with_its_transaction(self):
+        try:
+            with transaction.atomic():
+                events.enqueue('test.echo', {'n': 1})
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_batch_runs_handlers_once(self):
+        events.enqueue_many('test.echo', ({'n': n} for n in range(3)), batch_size=2)
+        self.assertEqual(worker.process_batch(batch_size=10, concurrency=1), (3, 0, 0))
+        self.assertEqual(self.calls, [{'n': 0}, {'n': 1}, {'n': 2}])
+        self.assertEqual(worker.process_batch(batch_size=10, concurrency=1), (0, 0, 0))
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.DONE).exists())
+
+    def test_failures_back_off_and_give_up(self):
+        def broken(payload):
+            raise ConnectionError('mail server down')
+        events.HANDLERS['test.broken'] = broken
+        message = events.enqueue('test.broken', {})
+
+        with self.assertLogs('outbox.worker', 'ERROR') as logs:
+            self.assertEqual(worker.process_batch(concurrency=1), (0, 1, 0))
+        self.assertEqual(logs.records[0].getMessage(), f'Outbox handler for {message} failed')
+        self.assertIn('ConnectionError: mail server down', logs.output[0])
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.last_error, 'ConnectionError: mail server down')
+        self.assertGreater(message.available_at, timezone.now() + timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(worker.process_batch(concurrency=1), (0, 0, 0))
+
+        OutboxMessage.objects.update(attempts=worker.MAX_ATTEMPTS - 1, available_at=timezone.now())
+        with self.assertLogs('outbox.worker', 'ERROR') as logs:
+            self.assertEqual(worker.process_batch(concurrency=1), (0, 0, 1))
+        self.assertEqual(len(logs.records), 1)
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.FAILED)
+
+    def test_claimed_messages_are_skipped_until_the_lease_ends(self):
+        events.enqueue('test.echo', {})
+        self.assertEqual(len(worker.claim_batch(10)), 1)
+        self.assertEqual(worker.claim_batch(10), [])
+
+
+class OutboxEmailTest(TestCase):
+    def test_checkout_confirmation_is_sent_by_the_worker(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(category=category, name='Linen Shirt', slug='linen-shirt',
+                                         price=Decimal('45.00'), stock=3)
+        self.client.post(reverse('cart:cart_add', args=[product.id]), {'quantity': 2, 'override': False})
+        self.client.post(reverse('orders:order_create'), {
+            'first_name': 'John', 'last_name': 'Doe', 'email': 'john@example.com',
+            'address': '123 Main St', 'postal_code': '54321', 'city': 'New City',
+        })
+        self.assertEqual(mail.outbox, [])
+
+        call_command('process_outbox', '--concurrency=1', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['john@example.com'])
+        self.assertIn('2 x Linen Shirt - $90.00', mail.outbox[0].body)
+        self.assertIn('Total: $90.00', mail.outbox[0].body)
+
+    def test_contact_notification_is_sent_by_the_worker(self):
+        self.client.post(reverse('pages:contact'), {
+            'name': 'Jane', 'email': 'jane@example.com',
+            'subject': 'Sizing', 'message': 'Do the shirts run small?',
+        })
+        self.assertEqual(OutboxMessage.objects.get().topic, 'contact.submitted')
+        call_command('process_outbox', '--concurrency=1', stdout=StringIO())
+        self.assertEqual(mail.outbox[0].subject, 'Contact form: Sizing')
+        self.assertIn('Do the shirts run small?', mail.outbox[0].body)
@@ -0,0 +1,98 @@
+"""
+Draining the outbox.
+
+A worker claims a batch of due messages by pushing their available_at
+forward by a lease and stamping them with a token, so concurrent workers
+never run the same message and a crashed worker's messages come back once
+the lease runs out. Handlers run in a thread pool; failures are retried
+with exponential backoff until MAX_ATTEMPTS.
+"""
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.utils import timezone
+
+from .events import HANDLERS
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=6)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(status=OutboxMessage.PENDING, available_at__lte=now)
+    ids = list(due.values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Re-checking available_at makes the claim lose cleanly if another
+    # worker took some of these messages in the meantime
+    due.filter(id__in=ids).update(available_at=now + LEASE, lock_token=token)
+    return list(OutboxMessage.objects.filter(lock_token=token, status=OutboxMessage.PENDING))
+
+
+def run_handler(message, close_connection=False):
+    """
+    Run the message's handler and return None on success or the error.
+    """
+    try:
+        func = HANDLERS.get(message.topic)
+        if func is None:
+            return f'No handler registered for {message.topic!r}'
+        func(message.payload)
+        return None
+    except Exception as exc:
+        logger.exception('Outbox handler for %s failed', message)
+        return f'{type(exc).__name__}: {exc}'
+    finally:
+        if close_connection:
+            connections.close_all()
+
+
+def process_batch(batch_size=50, concurrency=4):
+    """
+    Claim and handle one batch. Returns (succeeded, retried, failed) counts.
+    """
+    messages = claim_batch(batch_size)
+    if not messages:
+        return 0, 0, 0
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            errors = list(executor.map(lambda m: run_handler(m, close_connection=True), messages))
+    else:
+        errors = [run_handler(message) for message in messages]
+
+    now = timezone.now()
+    succeeded = retried = failed = 0
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        message.lock_token = ''
+        if error is None:
+            message.status = OutboxMessage.DONE
+            message.processed_at = now
+            message.last_error = ''
+            succeeded += 1
+        elif message.attempts >= MAX_ATTEMPTS:
+            message.status = OutboxMessage.FAILED
+            message.last_error = error
+            failed += 1
+        else:
+            message.available_at = now + retry_delay(message.attempts)
+            message.last_error = error
+            retried += 1
+    OutboxMessage.objects.bulk_update(
+        messages, ['status', 'attempts', 'available_at', 'lock_token', 'last_error', 'processed_at']
+    )
+    return succeeded, retried, failed
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+
+from outbox import events
+
+from .models import ContactSubmission
+
+
+@events.handler('contact.submitted')
+def send_contact_notification(payload):
+    submission = ContactSubmission.objects.filter(pk=payload['submission_id']).first()
+    if submission is None:
+        return
+    send_mail(
+        f'Contact form: {submission.subject}',
+        render_to_string('pages/emails/contact_notification.txt', {'submission': submission}),
+        None,
+        [settings.CONTACT_NOTIFICATION_EMAIL],
+    )
@@ -4,8 +4,10 @@ from django.contrib import messages
 from django.urls import reverse_lazy
 from django.views.generic.edit import FormView
 from django.utils import timezone
+from django.db import transaction
+
+from outbox import events
 
-from products.models import Category
 from .models import Page, ContactSubmission
 from .forms import ContactForm
 
@@ -18,11 +20,6 @@ class PageDetailView(DetailView):
     def get_queryset(self):
         return Page.objects.filter(is_active=True)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        return context
-
 def about(request):
     try:
         page = Page.objects.get(slug='about', is_active=True)
@@ -46,13 +43,8 @@ def about(request):
             is_active=True
         )
     
-    # Get categories for the navigation
-    from products.models import Category
-    categories = Category.objects.all()
-    
     return render(request, 'pages/page_detail.html', {
         'page': page,
-        'categories': categories
     })
 
 class ContactView(FormView):
@@ -62,8 +54,6 @@ class ContactView(FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        
         # Try to get the contact page content
         try:
             context['page'] = Page.objects.get(slug='contact', is_active=True)
@@ -85,16 +75,16 @@ class ContactView(FormView):
         return context
 
     def form_valid(self, form):
-        # Save the contact submission
-        ContactSubmission.objects.create(
-            name=form.cleaned_data['name'],
-            email=form.cleaned_data['email'],
-            subject=form.cleaned_data['subject'],
-            message=form.cleaned_data['message']
-        )
-        
-        # Send email notification (you'll need to implement this)
-        # send_contact_notification(form.cleaned_data)
+        # Save the contact submission; the notification email is sent by
+        # the outbox worker so the response doesn't wait on the mail server
+        with transaction.atomic():
+            submission = ContactSubmission.objects.create(
+                name=form.cleaned_data['name'],
+                email=form.cleaned_data['email'],
+                subject=form.cleaned_data['subject'],
+                message=form.cleaned_data['message']
+            )
+            events.enqueue('contact.submitted', {'submission_id': submission.pk})
         
         messages.success(self.request, 'Thank you for your message! We will get back to you soon.')
         return super().form_valid(form)
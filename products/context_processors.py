@@ -0,0 +1,4 @@
+from .navigation import get_categories
+
+def categories(request):
+    return {'categories': get_categories()}
@@ -0,0 +1,174 @@
+"""
+Sidebar facets for the product list.
+
+All facet counts for a listing come from a single aggregate query with one
+filtered COUNT per facet value, and the result is cached per normalized
+filter set until a product changes.
+"""
+import hashlib
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+
+# (label, lower bound inclusive, upper bound exclusive)
+PRICE_RANGES = (
+    ('Under $25', None, Decimal('25')),
+    ('$25 - $50', Decimal('25'), Decimal('50')),
+    ('$50 - $100', Decimal('50'), Decimal('100')),
+    ('$100 - $200', Decimal('100'), Decimal('200')),
+    ('$200 & above', Decimal('200'), None),
+)
+
+# Fixed-width price histogram; the last bin also holds everything above it
+HISTOGRAM_BIN_WIDTH = Decimal('20')
+HISTOGRAM_BINS = 10
+
+AVAILABILITY_CHOICES = {
+    'in_stock': Q(is_preorder=False, stock__gt=0),
+    'preorder': Q(is_preorder=True),
+}
+
+CACHE_TIMEOUT = 60 * 60
+VERSION_KEY = 'products:facets:version'
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return value if value.is_finite() and value >= 0 else None
+
+
+def parse_filters(params):
+    """
+    Read the facet filters from the request's GET parameters, dropping
+    anything invalid.
+    """
+    availability = params.get('availability', '')
+    return {
+        'min_price': _decimal(params.get('min_price') or None),
+        'max_price': _decimal(params.get('max_price') or None),
+        'price_below': _decimal(params.get('price_below') or None),
+        'availability': availability if availability in AVAILABILITY_CHOICES else '',
+    }
+
+
+def apply_filters(queryset, filters):
+    # The typed min and max prices are both inclusive; price range links
+    # set price_below instead, exclusive like PRICE_RANGES, so following
+    # one shows exactly the products it counted
+    queryset = queryset.filter(_price_range(filters['min_price'], filters['price_below']))
+    if filters['max_price'] is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters['availability']:
+        queryset = queryset.filter(AVAILABILITY_CHOICES[filters['availability']])
+    return queryset
+
+
+def _price_range(lower, upper):
+    condition = Q()
+    if lower is not None:
+        condition &= Q(price__gte=lower)
+    if upper is not None:
+        condition &= Q(price__lt=upper)
+    return condition
+
+
+def _histogram_bins():
+    for index in range(HISTOGRAM_BINS):
+        lower = HISTOGRAM_BIN_WIDTH * index
+        upper = lower + HISTOGRAM_BIN_WIDTH if index < HISTOGRAM_BINS - 1 else None
+        yield lower, upper
+
+
+def compute_facets(queryset, category_ids, category=None):
+    """
+    Count the products in ``queryset`` per facet value in one query.
+
+    ``queryset`` must not be narrowed to a category yet: category counts
+    are taken over all of it, so shoppers can see what the other
+    categories hold, while every other facet only counts ``category``.
+    """
+    in_category = Q(category=category) if category is not None else Q()
+    aggregates = {
+        'total': Count('id', filter=in_category),
+        'min_price': Min('price', filter=in_category),
+        'max_price': Max('price', filter=in_category),
+    }
+    for category_id in category_ids:
+        aggregates[f'category_{category_id}'] = Count('id', filter=Q(category_id=category_id))
+    for index, (_, lower, upper) in enumerate(PRICE_RANGES):
+        aggregates[f'range_{index}'] = Count('id', filter=in_category & _price_range(lower, upper))
+    for name, condition in AVAILABILITY_CHOICES.items():
+        aggregates[f'availability_{name}'] = Count('id', filter=in_category & condition)
+    for index, (lower, upper) in enumerate(_histogram_bins()):
+        aggregates[f'bin_{index}'] = Count('id', filter=in_category & _price_range(lower, upper))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    return {
+        'total': counts['total'],
+        'min_price': counts['min_price'],
+        'max_price': counts['max_price'],
+        'categories': {pk: counts[f'category_{pk}'] for pk in category_ids},
+        'price_ranges': [
+            {'label': label, 'min': lower, 'max': upper, 'count': counts[f'range_{index}']}
+            for index, (label, lower, upper) in enumerate(PRICE_RANGES)
+        ],
+        'availability': {name: counts[f'availability_{name}'] for name in AVAILABILITY_CHOICES},
+        'histogram': [
+            {'min': lower, 'max': upper, 'count': counts[f'bin_{index}']}
+            for index, (lower, upper) in enumerate(_histogram_bins())
+        ],
+    }
+
+
+def _cache_key(filter_key):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from a fresh number so entries left over from before the
+        # version key was evicted can never be served again
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    normalized = json.dumps(filter_key, sort_keys=True, default=str)
+    digest = hashlib.md5(normalized.encode(), usedforsecurity=False).hexdigest()
+    return f'products:facets:{version}:{digest}'
+
+
+def get_facets(queryset, categories, filter_key, category=None):
+    """
+    Return the facets for a listing, from the cache when possible.
+
+    ``filter_key`` must identify everything that narrows ``queryset``
+    (search query, facet filters) so equal keys mean equal results.
+    """
+    category_ids = [c.id for c in categories]
+    key = _cache_key({'filters': filter_key, 'category': category.id if category else None,
+                      'categories': category_ids})
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset, category_ids, category)
+        cache.set(key, facets, CACHE_TIMEOUT)
+
+    largest_bin = max((b['count'] for b in facets['histogram']), default=0)
+    return dict(
+        facets,
+        categories=[(c, facets['categories'].get(c.id, 0)) for c in categories],
+        histogram=[
+            dict(b, height=round(100 * b['count'] / largest_bin) if largest_bin else 0)
+            for b in facets['histogram']
+        ],
+    )
+
+
+def invalidate_facets():
+    """
+    Make every cached facet set stale.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
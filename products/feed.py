@@ -0,0 +1,147 @@
+"""
+The home page feed.
+
+The featured, new arrival and pre-order sections are materialized into
+HomeFeedItem rows whenever a product change affects them (or by the
+refresh_home_feed command), so rendering the home page is a single
+indexed read. Anonymous visitors with an empty cart all see the same page,
+so the fully rendered response is cached as well.
+"""
+import time
+
+from django.contrib import messages
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import HomeFeedItem, Product
+from . import navigation
+
+VERSION_KEY = 'products:home_feed:version'
+
+# Fields that decide which products the sections hold, and fields the home
+# page cards show; saves that change neither leave the home page alone
+FEED_FIELDS = ('available', 'name', 'created', 'is_preorder')
+CARD_FIELDS = ('name', 'slug', 'price', 'is_preorder', 'image', 'image_variants')
+WATCHED_FIELDS = tuple(dict.fromkeys(FEED_FIELDS + CARD_FIELDS))
+
+
+def section_querysets():
+    """
+    The queries each home page section is built from.
+    """
+    available = Product.objects.filter(available=True)
+    return {
+        'featured': available.order_by('name', 'id')[:8],
+        'new_arrivals': available.order_by('-created', '-id')[:8],
+        'preorder': available.filter(is_preorder=True).order_by('-created', '-id')[:4],
+    }
+
+
+def build_feed_items(querysets=None):
+    querysets = querysets or section_querysets()
+    return [
+        HomeFeedItem(section=section, position=position, product_id=product_id)
+        for section, queryset in querysets.items()
+        for position, product_id in enumerate(queryset.values_list('id', flat=True))
+    ]
+
+
+def refresh_home_feed():
+    """
+    Rebuild the stored feed and drop every cached copy of the home page.
+    """
+    items = build_feed_items()
+    with transaction.atomic():
+        HomeFeedItem.objects.all().delete()
+        HomeFeedItem.objects.bulk_create(items)
+    invalidate_home_page()
+    return items
+
+
+class PendingRefresh:
+    """
+    An on_commit() callback that refreshes the feed, recognisable while it
+    is still waiting for the commit.
+    """
+
+    def __init__(self):
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        refresh_home_feed()
+
+
+def schedule_refresh():
+    """
+    Refresh the feed when the current transaction commits, once however
+    many products change in it (e.g. a bulk edit in the admin).
+    """
+    connection = transaction.get_connection()
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, PendingRefresh) and not callback.done:
+            return
+    transaction.on_commit(PendingRefresh())
+
+
+def product_saved(product, stored=None):
+    """
+    Bring the home page up to date after ``product`` was saved, given the
+    WATCHED_FIELDS values it had before (None for a new product).
+    """
+    if stored is None:
+        schedule_refresh()
+        return
+    changed = {name for name in WATCHED_FIELDS if getattr(product, name) != stored[name]}
+    if changed.intersection(FEED_FIELDS):
+        schedule_refresh()
+    elif changed and HomeFeedItem.objects.filter(product=product).exists():
+        transaction.on_commit(invalidate_home_page)
+
+
+def get_home_feed():
+    """
+    Return {section: [products]} for every section, in one query.
+    """
+    feed = {section: [] for section, _ in HomeFeedItem.SECTION_CHOICES}
+    for item in HomeFeedItem.objects.select_related('product'):
+        feed[item.section].append(item.product)
+    return feed
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_home_page():
+    """
+    Drop every cached copy of the home page without rebuilding the feed.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def page_cache_key():
+    # The page also shows the category menu, so follow its version too
+    return (f'products:home_page:{_version(VERSION_KEY)}:'
+            f'{_version(navigation.VERSION_KEY)}')
+
+
+def is_page_cacheable(request):
+    """
+    Return True if the request would get the same page as every other
+    anonymous visitor: no query string (the header echoes the search box),
+    no login, nothing in the cart, no pending messages.
+    """
+    return (request.method == 'GET'
+            and not request.GET
+            and not request.user.is_authenticated
+            and not request.session.get(settings.CART_SESSION_ID)
+            and not len(messages.get_messages(request)))
@@ -0,0 +1,152 @@
+"""
+Resized WebP variants of product images.
+
+Cards and thumbnails show product photos a few hundred pixels wide, so
+every uploaded image gets smaller WebP copies and the templates offer them
+through srcset. What was generated is recorded on Product.image_variants:
+
+    {'source': 'products/2025/09/28/shirt.jpg', 'hash': '<sha1>',
+     'mtime': 1727496000.0, 'spec': '<spec>', 'width': 800,
+     'widths': [320, 640]}
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640, 960)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+VARIANT_DIR = 'variants'
+
+# Identifies the variant settings; changing any of them makes every
+# manifest out of date so the backfill regenerates all images
+SPEC = f'{VARIANT_FORMAT}-q{VARIANT_QUALITY}-{"-".join(map(str, VARIANT_WIDTHS))}'
+
+SIZES = {
+    'card': '(min-width: 1200px) 25vw, (min-width: 768px) 33vw, (min-width: 576px) 50vw, 100vw',
+    'detail': '(min-width: 992px) 50vw, 100vw',
+    'thumb': '80px',
+}
+
+
+def variant_name(image_name, width):
+    root, _ = os.path.splitext(image_name)
+    return f'{VARIANT_DIR}/{root}-{width}w.{VARIANT_EXTENSION}'
+
+
+def variant_names(manifest):
+    """
+    The storage names of the variant files ``manifest`` lists.
+    """
+    if not manifest or not manifest.get('source'):
+        return set()
+    return {variant_name(manifest['source'], width) for width in manifest.get('widths', [])}
+
+
+def delete_variants(manifest, keep=None, storage=default_storage):
+    """
+    Delete the variant files of ``manifest`` that the ``keep`` manifest
+    does not list as well.
+    """
+    for name in sorted(variant_names(manifest) - variant_names(keep)):
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete image variant %s', name, exc_info=True)
+
+
+def content_hash(data):
+    return hashlib.sha1(data, usedforsecurity=False).hexdigest()
+
+
+def render_variants(data, widths=VARIANT_WIDTHS):
+    """
+    Resize the image in ``data`` to every width narrower than the original.
+    Returns (original width, {width: encoded bytes}).
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        original_width, original_height = image.size
+        variants = {}
+        for width in widths:
+            if width >= original_width:
+                continue
+            height = max(1, round(original_height * width / original_width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+            variants[width] = buffer.getvalue()
+    return original_width, variants
+
+
+def build_manifest(image_name, data, original_width, widths, mtime=None):
+    return {
+        'source': image_name,
+        'hash': content_hash(data),
+        'mtime': mtime,
+        'spec': SPEC,
+        'width': original_width,
+        'widths': sorted(widths),
+    }
+
+
+def save_variants(image_name, variants, storage=default_storage):
+    for width, content in variants.items():
+        name = variant_name(image_name, width)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content))
+
+
+def is_current(manifest, image_name):
+    return (bool(manifest)
+            and manifest.get('source') == image_name
+            and manifest.get('spec') == SPEC)
+
+
+def generate_variants(product, storage=default_storage):
+    """
+    Generate and store the variants of the product's image and return the
+    new manifest, or an empty dict if the image cannot be read.
+    """
+    name = product.image.name
+    try:
+        with storage.open(name, 'rb') as source:
+            data = source.read()
+        original_width, variants = render_variants(data)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Could not create image variants for %s', name)
+        return {}
+    save_variants(name, variants, storage)
+    try:
+        mtime = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, OSError):
+        mtime = None
+    return build_manifest(name, data, original_width, variants, mtime)
+
+
+def srcset(product, storage=default_storage):
+    """
+    Return the srcset value for the product's image, or '' when it has no
+    current variants.
+    """
+    manifest = product.image_variants
+    if not product.image or not is_current(manifest, product.image.name):
+        return ''
+    candidates = [f'{storage.url(variant_name(product.image.name, width))} {width}w'
+                  for width in manifest['widths']]
+    if not candidates:
+        return ''
+    # The original stays the largest candidate for wide or dense screens
+    candidates.append(f'{product.image.url} {manifest["width"]}w')
+    return ', '.join(candidates)
@@ -1,71 +1,130 @@
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import cycle
+
 import requests
-from django.core.files.base import ContentFile
-from django.core.management.base import BaseCommand
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from products import feed
 from products.models import Product
-from django.conf import settings
+
+# Placeholder images from picsum.photos, handed out round-robin
+IMAGE_URLS = [f'https://picsum.photos/800/1000?random={n}' for n in range(1, 11)]
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+
+def make_session(pool_size):
+    """
+    A session whose connection pool is big enough for every worker thread,
+    so downloads reuse connections instead of opening one each.
+    """
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
 class Command(BaseCommand):
-    help = 'Adds demo images to products from a placeholder service'
+    help = ('Adds demo images to products without one, downloaded from a placeholder '
+            'service or copied from a local folder')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of parallel downloads or copies')
+        parser.add_argument('--source-dir',
+                            help='Assign images from this folder instead of downloading them')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Download timeout in seconds')
+
+    def store(self, product, source, extension):
+        # upload_to applies as if the image had been uploaded through the form
+        name = product.image.field.generate_filename(product, f'product_{product.id}{extension}')
+        return default_storage.save(name, File(source))
+
+    def download(self, session, product, url, timeout=10):
+        # Stream to a temporary file so no image is ever held in memory whole
+        with session.get(url, stream=True, timeout=timeout) as response, \
+                tempfile.TemporaryFile() as buffer:
+            response.raise_for_status()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+            buffer.seek(0)
+            return self.store(product, buffer, '.jpg')
+
+    def copy(self, product, path):
+        with open(path, 'rb') as source:
+            return self.store(product, source, os.path.splitext(path)[1].lower())
+
+    def source_files(self, source_dir):
+        if not os.path.isdir(source_dir):
+            raise CommandError(f'{source_dir} is not a directory')
+        paths = sorted(
+            os.path.join(source_dir, name) for name in os.listdir(source_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not paths:
+            raise CommandError(f'No images found in {source_dir}')
+        return paths
 
     def handle(self, *args, **options):
-        # List of placeholder image URLs (using placeholder.com with fashion-related keywords)
-        image_urls = [
-            'https://picsum.photos/800/1000?random=1',  # Fashion 1
-            'https://picsum.photos/800/1000?random=2',  # Fashion 2
-            'https://picsum.photos/800/1000?random=3',  # Fashion 3
-            'https://picsum.photos/800/1000?random=4',  # Fashion 4
-            'https://picsum.photos/800/1000?random=5',  # Fashion 5
-            'https://picsum.photos/800/1000?random=6',  # Fashion 6
-            'https://picsum.photos/800/1000?random=7',  # Fashion 7
-            'https://picsum.photos/800/1000?random=8',  # Fashion 8
-            'https://picsum.photos/800/1000?random=9',  # Fashion 9
-            'https://picsum.photos/800/1000?random=10', # Fashion 10
-        ]
-
-        # Create media directory if it doesn't exist
-        media_dir = os.path.join(settings.MEDIA_ROOT, 'products')
-        os.makedirs(media_dir, exist_ok=True)
-
-        products = Product.objects.all()
-        total_products = products.count()
-        
-        if total_products == 0:
-            self.stdout.write(self.style.WARNING('No products found. Please add some products first.'))
+        products = list(Product.objects.filter(image='').only('id', 'name', 'image').order_by('pk'))
+        skipped = Product.objects.exclude(image='').count()
+        if not products:
+            self.stdout.write(self.style.WARNING(
+                'No products without an image found. Please add some products first.'))
             return
 
-        self.stdout.write(f'Adding demo images to {total_products} products...')
-        
-        updated_count = 0
-        for i, product in enumerate(products):
-            if not product.image:  # Only add image if the product doesn't have one
-                try:
-                    # Cycle through the image URLs
-                    image_url = image_urls[i % len(image_urls)]
-                    
-                    # Download the image with a timeout and user-agent header
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                    }
-                    response = requests.get(image_url, headers=headers, stream=True, timeout=10)
-                    response.raise_for_status()
-                    
-                    # Get the image filename from the URL
-                    image_name = f"product_{product.id}_{i}.jpg"
-                    
-                    # Save the image to the product
-                    product.image.save(
-                        image_name,
-                        ContentFile(response.content),
-                        save=True
-                    )
-                    
-                    updated_count += 1
-                    self.stdout.write(self.style.SUCCESS(f'Added image to {product.name}'))
-                    
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'Error adding image to {product.name}: {str(e)}'))
-            else:
-                self.stdout.write(self.style.WARNING(f'Skipping {product.name} - already has an image'))
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully added demo images to {updated_count} products'))
+        if options['source_dir']:
+            sources = cycle(self.source_files(options['source_dir']))
+            jobs = [(self.copy, product, next(sources)) for product in products]
+        else:
+            session = make_session(options['workers'])
+            sources = cycle(IMAGE_URLS)
+            download = partial(self.download, session, timeout=options['timeout'])
+            jobs = [(download, product, next(sources)) for product in products]
+
+        self.stdout.write(f'Adding demo images to {len(products)} products '
+                          f'({skipped} already have one)...')
+
+        def run(job):
+            task, product, source = job
+            try:
+                return product, task(product, source), None
+            except (OSError, requests.RequestException) as exc:
+                return product, None, exc
+
+        updated = []
+        now = timezone.now()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for product, name, error in executor.map(run, jobs):
+                if error is not None:
+                    self.stdout.write(self.style.ERROR(f'Error adding image to {product.name}: {error}'))
+                    continue
+                product.image.name = name
+                product.updated = now
+                updated.append(product)
+
+        # One batched UPDATE instead of a save() per product. It skips the
+        # post_save handlers, so the home page and variants are seen to here
+        Product.objects.bulk_update(updated, ['image', 'updated'], batch_size=500)
+        if updated:
+            feed.invalidate_home_page()
+        self.stdout.write(self.style.SUCCESS(f'Successfully added demo images to {len(updated)} products'))
+        if updated:
+            self.stdout.write('Run "python manage.py generate_image_variants" to create their resized variants.')
@@ -0,0 +1,107 @@
+import re
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from products import facets, search
+from products.feed import section_querysets
+from products.models import Category, HomeFeedItem, Product
+from products.pagination import KeysetPaginator
+from products.views import PRODUCTS_PER_PAGE, SORT_ORDERINGS
+
+# A plain "SCAN <table>" reads every row; "SCAN <table> USING INDEX" walks
+# an index in order and stops at the LIMIT, which is what listings rely on
+FULL_SCAN_RE = re.compile(r'^SCAN (\S+)$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+SEEK_VALUES = {
+    'name': 'M',
+    'price': Decimal('50.00'),
+    'created': timezone.now(),
+    'id': 1,
+}
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN QUERY PLAN on every product listing query shape and '
+            'fail if any of them scans a whole table or sorts in a temp b-tree')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the plan of every query, not only failures')
+
+    def statement(self, func):
+        """
+        The SQL of the query ``func`` runs, for queries that are not
+        querysets (counts and aggregates). The query is run once.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return queries.captured_queries[-1]['sql']
+
+    def listing_variants(self):
+        category = Category(id=1)
+        for section, queryset in section_querysets().items():
+            yield f'home feed/{section}', queryset, False
+        yield 'home page', HomeFeedItem.objects.select_related('product'), False
+        for category_filter in (None, category):
+            products = Product.objects.filter(available=True)
+            label = 'all'
+            if category_filter is not None:
+                products = products.filter(category=category_filter)
+                label = 'category'
+            for sort, ordering in SORT_ORDERINGS.items():
+                paginator = KeysetPaginator(products, ordering, PRODUCTS_PER_PAGE)
+                first_page = paginator.seek()
+                values = [SEEK_VALUES[field] for field in paginator.fields]
+                yield f'{label}/{sort} page 1', first_page[:PRODUCTS_PER_PAGE], False
+                yield (f'{label}/{sort} page 3 (offset)',
+                       first_page[PRODUCTS_PER_PAGE * 2:PRODUCTS_PER_PAGE * 3], False)
+                yield (f'{label}/{sort} next cursor',
+                       paginator.seek(values)[:PRODUCTS_PER_PAGE + 1], False)
+                yield (f'{label}/{sort} previous cursor',
+                       paginator.seek(values, forward=False)[:PRODUCTS_PER_PAGE + 1], False)
+            # The same request counts the products for the page links and
+            # aggregates the sidebar facets over them
+            yield (f'{label}/count',
+                   self.statement(lambda: products.order_by().count()), False)
+            yield (f'{label}/facets',
+                   self.statement(lambda: facets.compute_facets(products, [category.id], category_filter)),
+                   False)
+            # Search results come from the FTS index, so sorting them in
+            # memory is expected
+            yield (f'{label}/search',
+                   search.filter_products(products, 'shirt').order_by(*SORT_ORDERINGS['name']), True)
+        yield 'category by slug', Category.objects.filter(slug='shoes'), False
+
+    def explain(self, queryset):
+        if isinstance(queryset, str):
+            sql, params = queryset, ()
+        else:
+            sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plans can only be checked on SQLite')
+
+        failures = []
+        for label, queryset, allow_sort in self.listing_variants():
+            plan = self.explain(queryset)
+            problems = [step for step in plan if FULL_SCAN_RE.match(step)]
+            if not allow_sort:
+                problems += [step for step in plan if step.startswith(TEMP_SORT)]
+            if problems:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f'{label}: {"; ".join(problems)}'))
+            elif options['verbose_plans']:
+                self.stdout.write(f'{label}: {"; ".join(plan)}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} listing queries are not index-only')
+        self.stdout.write(self.style.SUCCESS('All listing queries use indexes'))
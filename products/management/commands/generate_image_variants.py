@@ -0,0 +1,169 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from products import feed, images
+from products.models import Product
+
+
+def process_image(job):
+    """
+    Create the variants for one image. Runs in a worker process, so it only
+    deals in file paths and plain data.
+    """
+    pk, source_path, variant_paths, known_hash, known_widths = job
+    try:
+        mtime = os.path.getmtime(source_path)
+        with open(source_path, 'rb') as source:
+            data = source.read()
+        digest = images.content_hash(data)
+        # Touched but not changed: keep the variants, record the new mtime
+        if digest == known_hash and all(os.path.exists(variant_paths[w]) for w in known_widths):
+            return pk, {'status': 'unchanged', 'hash': digest, 'mtime': mtime}
+        original_width, variants = images.render_variants(data, tuple(variant_paths))
+        for width, content in variants.items():
+            path = variant_paths[width]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so an interrupted run never leaves half a file
+            partial = f'{path}.partial'
+            with open(partial, 'wb') as out:
+                out.write(content)
+            os.replace(partial, path)
+        return pk, {'status': 'generated', 'hash': digest, 'mtime': mtime,
+                    'width': original_width, 'widths': sorted(variants)}
+    except Exception as exc:
+        return pk, {'status': 'error', 'error': f'{type(exc).__name__}: {exc}'}
+
+
+class Command(BaseCommand):
+    help = ('Create missing or outdated image variants for every product, '
+            'in parallel. Safe to interrupt and re-run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Products loaded and saved per batch')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants even if they look up to date')
+        parser.add_argument('--no-prune', action='store_false', dest='prune',
+                            help='Keep variant files that no product uses any more')
+
+    def needs_work(self, product, force):
+        manifest = product.image_variants
+        if force or not images.is_current(manifest, product.image.name):
+            return True
+        # Same source and spec: only look inside the file if it was touched
+        try:
+            mtime = os.path.getmtime(default_storage.path(product.image.name))
+        except OSError:
+            return False
+        return mtime != manifest.get('mtime')
+
+    def make_job(self, product, force):
+        name = product.image.name
+        manifest = product.image_variants
+        reusable = not force and images.is_current(manifest, name)
+        known_hash = manifest.get('hash') if reusable else None
+        known_widths = [w for w in manifest.get('widths', []) if w in images.VARIANT_WIDTHS]
+        variant_paths = {width: default_storage.path(images.variant_name(name, width))
+                         for width in images.VARIANT_WIDTHS}
+        return product.pk, default_storage.path(name), variant_paths, known_hash, known_widths
+
+    def process_chunk(self, executor, chunk, force, totals):
+        pending = [product for product in chunk if self.needs_work(product, force)]
+        totals['skipped'] += len(chunk) - len(pending)
+        if not pending:
+            return
+        by_pk = {product.pk: product for product in pending}
+        jobs = [self.make_job(product, force) for product in pending]
+        now = timezone.now()
+        changed = []
+        for pk, result in executor.map(process_image, jobs):
+            product = by_pk[pk]
+            status = result.pop('status')
+            totals[status] += 1
+            if status == 'error':
+                self.stderr.write(f'Product {pk} ({product.image.name}): {result["error"]}')
+                continue
+            if status == 'unchanged':
+                manifest = dict(product.image_variants, **result)
+            else:
+                manifest = {'source': product.image.name, 'spec': images.SPEC, **result}
+                product.updated = now
+            product.image_variants = manifest
+            changed.append(product)
+        # Saving per chunk is what makes the command restartable
+        Product.objects.bulk_update(changed, ['image_variants', 'updated'])
+
+    def prune(self, started_at):
+        """
+        Delete the variant files no product's manifest lists, such as those
+        of replaced or deleted images and of widths no longer generated.
+        Files written since ``started_at`` are kept: they may belong to an
+        upload saved after the manifests were read.
+        """
+        used = set()
+        manifests = Product.objects.exclude(image='').values_list('image_variants', flat=True)
+        for manifest in manifests.iterator(chunk_size=2000):
+            used |= images.variant_names(manifest)
+        media_root = default_storage.path('')
+        removed = 0
+        for directory, _, filenames in os.walk(default_storage.path(images.VARIANT_DIR)):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, media_root).replace(os.sep, '/')
+                try:
+                    if name in used or os.path.getmtime(path) >= started_at:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+        return removed
+
+    def handle(self, *args, **options):
+        try:
+            default_storage.path('')
+        except NotImplementedError:
+            raise CommandError('Variants can only be backfilled on a local file storage')
+
+        totals = {'generated': 0, 'unchanged': 0, 'skipped': 0, 'error': 0}
+        started_at = time.time()
+        products = (Product.objects.exclude(image='')
+                    .only('id', 'image', 'image_variants', 'updated')
+                    .order_by('pk'))
+        chunk_size = options['chunk_size']
+        started = time.monotonic()
+        chunk = []
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for product in products.iterator(chunk_size=chunk_size):
+                chunk.append(product)
+                if len(chunk) >= chunk_size:
+                    self.process_chunk(executor, chunk, options['force'], totals)
+                    chunk = []
+                    self.report(totals, started)
+            self.process_chunk(executor, chunk, options['force'], totals)
+
+        if totals['generated']:
+            # Cached pages embed the cards' srcset
+            feed.invalidate_home_page()
+        self.report(totals, started, final=True)
+        if options['prune']:
+            self.stdout.write(f'{self.prune(started_at)} unused variant files removed')
+
+    def report(self, totals, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        processed = totals['generated'] + totals['unchanged']
+        message = (f'{totals["generated"]} generated, {totals["unchanged"]} unchanged, '
+                   f'{totals["skipped"]} up to date, {totals["error"]} failed '
+                   f'in {elapsed:.1f}s ({processed / elapsed:.1f} images/s)')
+        if final:
+            style = self.style.SUCCESS if not totals['error'] else self.style.WARNING
+            self.stdout.write(style(message))
+        else:
+            self.stdout.write(message)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of products indexed per batch')
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write(self.style.WARNING(
+                'Full-text search is only available on SQLite; nothing to rebuild.'))
+            return
+
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products.feed import refresh_home_feed
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home page feed'
+
+    def handle(self, *args, **options):
+        items = refresh_home_feed()
+        self.stdout.write(self.style.SUCCESS(f'Home feed rebuilt with {len(items)} entries'))
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from products import search
+
+    if not search.is_enabled(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        search.create_index(cursor)
+        cursor.execute(
+            f'INSERT INTO {search.FTS_TABLE} (rowid, name, description, category) '
+            'SELECT p.id, p.name, p.description, c.name '
+            'FROM products_product p JOIN products_category c ON c.id = p.category_id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    from products import search
+
+    if not search.is_enabled(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        search.drop_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_initial_feed(apps, schema_editor):
+    HomeFeedItem = apps.get_model('products', 'HomeFeedItem')
+    Product = apps.get_model('products', 'Product')
+    available = Product.objects.filter(available=True)
+    sections = {
+        'featured': available.order_by('name', 'id')[:8],
+        'new_arrivals': available.order_by('-created', '-id')[:8],
+        'preorder': available.filter(is_preorder=True).order_by('-created', '-id')[:4],
+    }
+    HomeFeedItem.objects.bulk_create([
+        HomeFeedItem(section=section, position=position, product_id=product_id)
+        for section, queryset in sections.items()
+        for position, product_id in enumerate(queryset.values_list('id', flat=True))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HomeFeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(choices=[('featured', 'Featured Products'), ('new_arrivals', 'New Arrivals'), ('preorder', 'Pre-Order Picks')], max_length=20)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'ordering': ('section', 'position'),
+                'constraints': [models.UniqueConstraint(fields=('section', 'position'), name='unique_home_feed_slot')],
+            },
+        ),
+        migrations.RunPython(build_initial_feed, migrations.RunPython.noop),
+    ]
@@ -29,15 +29,56 @@ class Product(models.Model):
     is_preorder = models.BooleanField(default=False)
     preorder_release_date = models.DateField(null=True, blank=True)
     stock = models.PositiveIntegerField(default=0)
+    # Resized copies of image, see products.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ('name',)
         indexes = [
             models.Index(fields=['id', 'slug']),
+            # Listings only ever show available products, sorted by name,
+            # price or creation date and optionally narrowed to a category.
+            # Descending sorts walk these indexes backwards; SQLite appends
+            # the rowid to every index, which covers the id tie-breaker.
+            models.Index(fields=['name'], condition=models.Q(available=True),
+                         name='product_available_name_idx'),
+            models.Index(fields=['price'], condition=models.Q(available=True),
+                         name='product_available_price_idx'),
+            models.Index(fields=['created'], condition=models.Q(available=True),
+                         name='product_available_created_idx'),
+            models.Index(fields=['category', 'name'], condition=models.Q(available=True),
+                         name='product_cat_name_idx'),
+            models.Index(fields=['category', 'price'], condition=models.Q(available=True),
+                         name='product_cat_price_idx'),
+            models.Index(fields=['category', 'created'], condition=models.Q(available=True),
+                         name='product_cat_created_idx'),
         ]
     
     def __str__(self):
         return self.name
     
     def get_absolute_url(self):
-        return reverse('products:product_detail', args=[self.id, self.slug])
\ No newline at end of file
+        return reverse('products:product_detail', args=[self.id, self.slug])
+
+class HomeFeedItem(models.Model):
+    """
+    A precomputed slot on the home page, rebuilt by products.feed.
+    """
+    SECTION_CHOICES = (
+        ('featured', 'Featured Products'),
+        ('new_arrivals', 'New Arrivals'),
+        ('preorder', 'Pre-Order Picks'),
+    )
+    
+    section = models.CharField(max_length=20, choices=SECTION_CHOICES)
+    position = models.PositiveSmallIntegerField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    
+    class Meta:
+        ordering = ('section', 'position')
+        constraints = [
+            models.UniqueConstraint(fields=['section', 'position'], name='unique_home_feed_slot'),
+        ]
+    
+    def __str__(self):
+        return f'{self.get_section_display()} #{self.position}'
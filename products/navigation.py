@@ -0,0 +1,53 @@
+"""
+Process-local cache of the category list used by the site navigation.
+
+Categories change a few times a year but are shown on every page, so each
+process keeps its own copy and only checks a version number in the cache;
+saving or deleting a category bumps the version and every process sharing
+that cache reloads the list on its next request. The copy is also
+reloaded after LOCAL_TTL seconds, which bounds how stale it can get when
+the cache is not shared between processes (the local-memory backend).
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Category
+
+VERSION_KEY = 'products:categories:version'
+LOCAL_TTL = 60
+
+# (version, expires, categories) replaced as a whole so readers never see
+# a mix
+_cached = (None, 0, ())
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_categories():
+    """
+    Return all categories as a tuple, ordered by name.
+    """
+    global _cached
+    version = _current_version()
+    cached_version, expires, categories = _cached
+    now = time.monotonic()
+    if cached_version != version or now >= expires:
+        categories = tuple(Category.objects.all())
+        _cached = (version, now + LOCAL_TTL, categories)
+    return categories
+
+
+def invalidate_categories():
+    global _cached
+    _cached = (None, 0, ())
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
@@ -0,0 +1,192 @@
+"""
+Paginators for large listings.
+
+KeysetPaginator pages by "everything after the last row I saw" instead of
+OFFSET, so every page costs the same no matter how deep it is and no
+COUNT(*) is needed. CachedCountPaginator keeps the page-number UI but
+reuses a recent COUNT(*) for the same query instead of running it on every
+request.
+"""
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class KeysetPage:
+    """
+    One page of a keyset paginated queryset.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], 'previous')
+        return None
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by the values of its ordering fields.
+
+    ``ordering`` must end with a unique field (normally the primary key) so
+    that rows with equal sort values still have a stable position.
+    Cursors are signed, so clients cannot forge or inspect them.
+    """
+    cursor_salt = CURSOR_SALT
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+        self.salt = f'{self.cursor_salt}:{",".join(self.ordering)}'
+
+    def encode_cursor(self, obj, direction):
+        values = [_encode_value(getattr(obj, field)) for field in self.fields]
+        return signing.dumps([direction[0], values], salt=self.salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=self.salt)
+        except (signing.BadSignature, TypeError, ValueError) as exc:
+            raise InvalidCursor(str(exc)) from exc
+        if direction not in ('n', 'p') or len(values) != len(self.fields):
+            raise InvalidCursor('Malformed cursor')
+        opts = self.queryset.model._meta
+        try:
+            values = [opts.get_field(field).to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except Exception as exc:
+            raise InvalidCursor(str(exc)) from exc
+        return direction, values
+
+    def _seek_filter(self, values, forward):
+        # (a, b, c) > (x, y, z) written out as
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        lookups = []
+        for index, field in enumerate(self.fields):
+            lookup = 'lt' if self.descending[index] == forward else 'gt'
+            lookups.append(lookup)
+            term = Q(**{f'{field}__{lookup}': values[index]})
+            for previous in range(index):
+                term &= Q(**{self.fields[previous]: values[previous]})
+            condition |= term
+        # The redundant a >= x bound lets the database seek straight into
+        # the index instead of filtering it from the start
+        return Q(**{f'{self.fields[0]}__{lookups[0]}e': values[0]}) & condition
+
+    def seek(self, values=None, forward=True, queryset=None):
+        """
+        Return the ordered queryset of rows after (or, going backwards,
+        before) the row with the given ordering values.
+        """
+        queryset = self.queryset if queryset is None else queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, forward))
+        if forward:
+            return queryset.order_by(*self.ordering)
+        return queryset.order_by(*[_reverse(field) for field in self.ordering])
+
+    def fetch(self, values, forward):
+        """
+        Up to a page and one more row in seek order; the extra row tells
+        whether there is another page.
+        """
+        return list(self.seek(values, forward)[:self.per_page + 1])
+
+    def page(self, cursor=None):
+        """
+        Return the page after (or before) the given cursor, or the first
+        page when no cursor is given.
+        """
+        direction, values = ('n', None) if not cursor else self.decode_cursor(cursor)
+        forward = direction == 'n'
+        rows = self.fetch(values, forward)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return KeysetPage(rows, self, has_next=has_more, has_previous=values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+
+
+class CachedCountPaginator(Paginator):
+    """
+    A Paginator whose total count is cached for a short time per query.
+
+    The count may be slightly stale, which is fine for drawing page links
+    but means the last page can come up short or empty.
+    """
+
+    def __init__(self, *args, count_timeout=300, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def count(self):
+        if not self.count_timeout or not hasattr(self.object_list, 'query'):
+            return super().count
+        sql, params = self.object_list.query.sql_with_params()
+        digest = hashlib.md5(f'{sql}{params!r}'.encode(), usedforsecurity=False).hexdigest()
+        key = f'paginator:count:{digest}'
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, self.count_timeout)
+        return count
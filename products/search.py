@@ -0,0 +1,164 @@
+"""
+Full-text search over the product catalog.
+
+On SQLite the catalog is mirrored into an FTS5 virtual table whose rowid is
+the product id, so a search is an index lookup ranked by bm25 instead of a
+LIKE scan over products joined to categories. Product querysets are
+filtered against the index with a subquery, so every match is kept for
+the other sorts and the page count. Other database backends fall back to
+the original icontains filter.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'products_product_fts'
+
+# bm25 column weights: name, description, category name
+RANK_WEIGHTS = (10.0, 1.0, 5.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_enabled(conn=None):
+    """
+    Return True if the database supports the FTS5 search index.
+    """
+    return (conn or connection).vendor == 'sqlite'
+
+
+def create_index(cursor):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, description, category, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def drop_index(cursor):
+    cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def _rows(products):
+    for product in products:
+        yield (product.id, product.name, product.description, product.category.name)
+
+
+def index_products(products):
+    """
+    Insert or replace the index rows for the given products.
+    """
+    if not is_enabled():
+        return
+    rows = list(_rows(products))
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) '
+            'VALUES (%s, %s, %s, %s)', rows)
+
+
+def remove_products(product_ids):
+    """
+    Remove the index rows for the given product ids.
+    """
+    if not is_enabled() or not product_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(pk,) for pk in product_ids])
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Rebuild the whole index from the Product table. Returns the number of
+    indexed products.
+    """
+    from .models import Product
+
+    if not is_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        drop_index(cursor)
+        create_index(cursor)
+    products = Product.objects.select_related('category').order_by('pk')
+    batch = []
+    count = 0
+    for product in products.iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            index_products(batch)
+            count += len(batch)
+            batch = []
+    index_products(batch)
+    return count + len(batch)
+
+
+def build_match_expression(query):
+    """
+    Turn free text into an FTS5 MATCH expression where every term must
+    match, and each term also matches as a prefix ("jea" finds "jeans").
+    """
+    terms = _TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def filter_products(queryset, query):
+    """
+    Narrow a product queryset to the products matching the query.
+    """
+    expression = build_match_expression(query)
+    if not expression:
+        return queryset.none()
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]
+    ))
+
+
+def order_by_rank(queryset, query):
+    """
+    Order a product queryset best match first. The bm25 rank is only used
+    for the ordering, looked up by rowid for each matching product.
+    """
+    expression = build_match_expression(query)
+    if not expression:
+        return queryset
+    table = queryset.model._meta.db_table
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}, %s, %s, %s) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+        [*RANK_WEIGHTS, expression], output_field=FloatField(),
+    )
+    return queryset.alias(search_rank=rank).order_by('search_rank', 'id')
+
+
+def search_product_ids(query, limit=None):
+    """
+    Return product ids matching the query, best match first.
+    """
+    expression = build_match_expression(query)
+    if not expression:
+        return []
+    sql = (f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+           f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s)')
+    params = [expression, *RANK_WEIGHTS]
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fallback_filter(query):
+    """
+    The LIKE based filter used where FTS5 is not available.
+    """
+    return (Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__name__icontains=query))
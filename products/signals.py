@@ -0,0 +1,83 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import facets, feed, images, search
+from .navigation import invalidate_categories
+from .models import Category, Product
+
+
+@receiver(pre_save, sender=Product)
+def remember_feed_fields(sender, instance, raw=False, **kwargs):
+    # Read from the database so the home page only changes when one of
+    # the fields it depends on does
+    instance._feed_fields = None
+    if not raw and not instance._state.adding:
+        instance._feed_fields = (Product.objects.filter(pk=instance.pk)
+                                 .values(*feed.WATCHED_FIELDS).first())
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance])
+    facets.invalidate_facets()
+    feed.product_saved(instance, instance.__dict__.pop('_feed_fields', None))
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if not instance.image:
+        manifest = {}
+    elif images.is_current(instance.image_variants, instance.image.name):
+        return
+    else:
+        manifest = images.generate_variants(instance)
+    if manifest == instance.image_variants:
+        return
+    delete_unused_variants(instance, instance.image_variants, keep=manifest)
+    # update() keeps this from firing post_save again; bumping updated
+    # makes cached cards pick up the new srcset
+    instance.image_variants = manifest
+    instance.updated = timezone.now()
+    Product.objects.filter(pk=instance.pk).update(image_variants=manifest,
+                                                  updated=instance.updated)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    facets.invalidate_facets()
+    feed.schedule_refresh()
+    delete_unused_variants(instance, instance.image_variants)
+
+
+def delete_unused_variants(product, manifest, keep=None):
+    """
+    Delete the variants of a replaced or deleted image once the change is
+    committed, unless another product shows the same image.
+    """
+    source = (manifest or {}).get('source')
+    if not source or Product.objects.filter(image=source).exclude(pk=product.pk).exists():
+        return
+    transaction.on_commit(lambda: images.delete_variants(manifest, keep=keep))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_category_navigation(sender, **kwargs):
+    invalidate_categories()
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # The category name is part of each product's index row
+    if raw or created:
+        return
+    products = instance.products.all()
+    for product in products:
+        product.category = instance
+    search.index_products(products)
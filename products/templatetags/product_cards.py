@@ -0,0 +1,60 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+CARD_TEMPLATES = {
+    'list': 'products/includes/card_list.html',
+    'home': 'products/includes/card_home.html',
+}
+
+# Bump when the card templates change so old fragments are not served
+CARD_CACHE_VERSION = 2
+
+# Cards are shared between visitors, so the per-visitor CSRF token is
+# rendered as this marker and swapped in after the cache lookup
+CSRF_PLACEHOLDER = '__product_card_csrf_token__'
+
+
+def card_cache_key(product, variant):
+    return (f'products:card:{CARD_CACHE_VERSION}:{variant}:'
+            f'{product.id}:{product.updated.timestamp()}')
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, variant):
+    """
+    Render the card of every product, reusing cached fragments.
+
+    Usage::
+
+        {% product_cards products 'list' as cards %}
+        {% for product, card in cards %}{{ card }}{% endfor %}
+
+    The whole page of cards is fetched with a single cache.get_many() and
+    cards that were missing are stored with a single cache.set_many(); a
+    card is re-rendered whenever its product's ``updated`` changes.
+    """
+    products = list(products)
+    keys = [card_cache_key(product, variant) for product in products]
+    cards = cache.get_many(keys)
+
+    missing = {}
+    for key, product in zip(keys, products):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATES[variant], {
+                'product': product,
+                'csrf_token': CSRF_PLACEHOLDER,
+            })
+    if missing:
+        cache.set_many(missing, settings.PRODUCT_CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+
+    csrf_token = str(context.get('csrf_token', ''))
+    return [
+        (product, mark_safe(cards[key].replace(CSRF_PLACEHOLDER, csrf_token)))
+        for key, product in zip(keys, products)
+    ]
@@ -0,0 +1,27 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from products import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, size='card', **attrs):
+    """
+    Render the product's image as an <img> whose srcset offers the resized
+    WebP variants, so browsers download only the width they display.
+
+    Usage::
+
+        {% product_image product 'card' class='card-img-top' loading='lazy' %}
+
+    ``size`` picks the ``sizes`` hint from products.images.SIZES.
+    """
+    attrs = {'src': product.image.url, 'alt': product.name, **attrs}
+    srcset = images.srcset(product)
+    if srcset:
+        attrs['srcset'] = srcset
+        attrs['sizes'] = images.SIZES[size]
+    return format_html('<img{}>', flatatt(attrs))
@@ -6,9 +6,22 @@ from django.core.files.images import ImageFile
 import tempfile
 import shutil
 import os
+import time
+from io import StringIO
+from django.core.management import call_command
 from decimal import Decimal
+from django.core.cache import cache
+from django.test import override_settings
+from io import BytesIO
+from unittest import mock
+from PIL import Image
 
 from .models import Category, Product
+from . import facets, images, navigation, search, views
+from .feed import get_home_feed, invalidate_home_page, page_cache_key
+from .navigation import get_categories
+from .pagination import CachedCountPaginator
+from .templatetags.product_cards import CSRF_PLACEHOLDER, card_cache_key
 
 class CategoryModelTest(TestCase):
     def setUp(self):
@@ -119,4 +132,488 @@ class ProductViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'products/product_detail.html')
         self.assertContains(response, 'Test Product')
-        self.assertContains(response, '99.99')
\ No newline at end of file
+        self.assertContains(response, '99.99')
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(
+            name='Denim',
+            slug='denim'
+        )
+        self.jeans = Product.objects.create(
+            category=self.category,
+            name='Slim Fit Jeans',
+            slug='slim-fit-jeans',
+            description='Classic jeans made from premium cotton.',
+            price=Decimal('69.99'),
+            stock=10
+        )
+        self.shirt = Product.objects.create(
+            category=Category.objects.create(name='Shirts', slug='shirts'),
+            name='Oxford Shirt',
+            slug='oxford-shirt',
+            description='Pairs well with jeans.',
+            price=Decimal('39.99'),
+            stock=10
+        )
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(search.search_product_ids('jeans'), [self.jeans.id, self.shirt.id])
+
+    def test_search_matches_prefixes(self):
+        self.assertEqual(search.search_product_ids('oxf'), [self.shirt.id])
+
+    def test_search_requires_every_term(self):
+        self.assertEqual(search.search_product_ids('slim cotton'), [self.jeans.id])
+        self.assertEqual(search.search_product_ids('slim shirt'), [])
+
+    def test_index_follows_product_and_category_changes(self):
+        self.jeans.name = 'Straight Leg Trousers'
+        self.jeans.save()
+        self.assertEqual(search.search_product_ids('trousers'), [self.jeans.id])
+
+        self.category.name = 'Workwear'
+        self.category.save()
+        self.assertEqual(search.search_product_ids('workwear'), [self.jeans.id])
+
+        self.shirt.delete()
+        self.assertEqual(search.search_product_ids('oxford'), [])
+
+    def test_rebuild_index(self):
+        Product.objects.filter(pk=self.jeans.pk).update(name='Cargo Pants')
+        self.assertEqual(search.search_product_ids('cargo'), [])
+        self.assertEqual(search.rebuild_index(), 2)
+        self.assertEqual(search.search_product_ids('cargo'), [self.jeans.id])
+
+    def test_product_list_search(self):
+        response = self.client.get(reverse('products:product_list'), {'q': 'jea'})
+        self.assertEqual(response.context['sort_by'], 'relevance')
+        self.assertEqual([p.id for p in response.context['products']],
+                         [self.jeans.id, self.shirt.id])
+        response = self.client.get(reverse('products:product_list'),
+                                   {'q': 'jeans', 'sort': 'price_asc'})
+        self.assertEqual([p.id for p in response.context['products']],
+                         [self.shirt.id, self.jeans.id])
+
+    def test_every_match_is_kept(self):
+        Product.objects.bulk_create([
+            Product(category=self.category, name=f'Jeans {n}', slug=f'jeans-{n}',
+                    price=Decimal('10.00'), stock=1)
+            for n in range(600)
+        ])
+        # bulk_create sends no signals
+        search.index_products(Product.objects.select_related('category').filter(slug__startswith='jeans-'))
+        products = search.filter_products(Product.objects.all(), 'jeans')
+        self.assertEqual(products.count(), 602)
+        # Matched only through its description
+        self.assertEqual(search.order_by_rank(products, 'jeans').last(), self.shirt)
+        response = self.client.get(reverse('products:product_list'), {'q': 'jeans'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 602)
+
+
+class ProductPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(
+            name='Test Category',
+            slug='test-category'
+        )
+        # Plenty of equal prices and names so tie-breaking matters
+        for i in range(30):
+            Product.objects.create(
+                category=self.category,
+                name=f'Product {i % 4}',
+                slug=f'product-{i}',
+                price=Decimal('10.00') + (i % 3),
+                stock=5
+            )
+
+    def walk(self, sort):
+        url = reverse('products:product_list')
+        ids = []
+        cursor = ''
+        pages = []
+        while cursor is not None:
+            response = self.client.get(url, {'sort': sort, 'cursor': cursor})
+            page = response.context['page_obj']
+            pages.append(page)
+            ids.extend(p.id for p in page)
+            cursor = page.next_cursor
+        return ids, pages
+
+    def test_cursor_pages_cover_every_product_once_per_sort(self):
+        for sort, ordering in views.SORT_ORDERINGS.items():
+            ids, pages = self.walk(sort)
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(ids, expected, sort)
+            self.assertEqual(len(pages), 3)
+            self.assertFalse(pages[0].has_previous())
+            self.assertFalse(pages[-1].has_next())
+
+    def test_previous_cursor_returns_previous_page(self):
+        _, pages = self.walk('price_desc')
+        response = self.client.get(reverse('products:product_list'),
+                                   {'sort': 'price_desc', 'cursor': pages[2].previous_cursor})
+        self.assertEqual([p.id for p in response.context['page_obj']],
+                         [p.id for p in pages[1]])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('products:product_list'), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].has_previous())
+        self.assertEqual(len(response.context['page_obj']), 12)
+
+    def test_page_count_is_cached(self):
+        queryset = Product.objects.filter(available=True).order_by('name', 'id')
+        self.assertEqual(CachedCountPaginator(queryset, 12).count, 30)
+        Product.objects.filter(slug='product-0').delete()
+        self.assertEqual(CachedCountPaginator(queryset, 12).count, 30)
+        self.assertEqual(CachedCountPaginator(queryset, 12, count_timeout=0).count, 29)
+
+    def test_page_links_keep_query_and_sort(self):
+        response = self.client.get(reverse('products:product_list'), {'sort': 'newest'})
+        self.assertContains(response, 'href="?sort=newest&amp;page=2"')
+
+
+class ListingQueryPlanTest(TestCase):
+    def test_listing_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', '--verbose-plans', stdout=out)
+        self.assertIn('All listing queries use indexes', out.getvalue())
+        self.assertIn('category/count: SEARCH products_product USING INDEX', out.getvalue())
+        self.assertIn('category/facets: SEARCH products_product USING INDEX', out.getvalue())
+
+
+class ProductFacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirts = Category.objects.create(name='Shirts', slug='shirts')
+        self.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for i, price in enumerate(['10.00', '30.00', '45.00']):
+            Product.objects.create(category=self.shirts, name=f'Shirt {i}', slug=f'shirt-{i}',
+                                   price=Decimal(price), stock=5)
+        Product.objects.create(category=self.shoes, name='Sneaker', slug='sneaker',
+                               price=Decimal('250.00'), stock=0, is_preorder=True)
+
+    def get_facets(self, category=None, **params):
+        categories = list(Category.objects.all())
+        filters = facets.parse_filters(params)
+        queryset = facets.apply_filters(Product.objects.filter(available=True), filters)
+        return facets.get_facets(queryset, categories, filters, category)
+
+    def test_facet_counts(self):
+        with self.assertNumQueries(2):
+            result = self.get_facets()
+        self.assertEqual(result['total'], 4)
+        self.assertEqual(result['categories'], [(self.shirts, 3), (self.shoes, 1)])
+        self.assertEqual([r['count'] for r in result['price_ranges']], [1, 2, 0, 0, 1])
+        self.assertEqual(result['availability'], {'in_stock': 3, 'preorder': 1})
+        self.assertEqual(sum(b['count'] for b in result['histogram']), 4)
+        self.assertEqual(result['histogram'][1]['height'], 100)
+
+    def test_category_counts_ignore_current_category(self):
+        result = self.get_facets(category=self.shoes)
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['categories'], [(self.shirts, 3), (self.shoes, 1)])
+        self.assertEqual(result['availability'], {'in_stock': 0, 'preorder': 1})
+
+    def test_filters_narrow_facets(self):
+        result = self.get_facets(min_price='20', availability='in_stock')
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(self.get_facets(min_price='abc')['total'], 4)
+
+    def test_facets_are_cached_until_a_product_changes(self):
+        self.get_facets()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_facets()['total'], 4)
+        Product.objects.create(category=self.shoes, name='Boot', slug='boot',
+                               price=Decimal('80.00'), stock=2)
+        self.assertEqual(self.get_facets()['total'], 5)
+
+    def test_product_list_filters(self):
+        response = self.client.get(reverse('products:product_list'),
+                                   {'availability': 'preorder'})
+        self.assertEqual([p.name for p in response.context['products']], ['Sneaker'])
+        self.assertEqual(response.context['facets']['availability']['in_stock'], 0)
+        response = self.client.get(reverse('products:product_list_by_category', args=['shirts']),
+                                   {'max_price': '30'})
+        self.assertEqual([p.name for p in response.context['products']], ['Shirt 0', 'Shirt 1'])
+
+    def test_price_range_link_matches_its_count(self):
+        Product.objects.create(category=self.shirts, name='Shirt 50', slug='shirt-50',
+                               price=Decimal('50.00'), stock=5)
+        price_range = self.get_facets()['price_ranges'][1]
+        self.assertEqual((price_range['label'], price_range['count']), ('$25 - $50', 2))
+        response = self.client.get(reverse('products:product_list'),
+                                   {'min_price': price_range['min'], 'price_below': price_range['max']})
+        self.assertEqual([p.name for p in response.context['products']], ['Shirt 1', 'Shirt 2'])
+        self.assertContains(response, 'min_price=25&amp;price_below=50')
+
+
+class CategoryNavigationTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shirts', slug='shirts')
+
+    def test_categories_are_cached_until_a_category_changes(self):
+        self.assertEqual(get_categories(), (self.category,))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_categories(), (self.category,))
+
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        self.assertEqual(get_categories(), (self.category, shoes))
+
+        self.category.name = 'Tops'
+        self.category.save()
+        self.assertEqual(get_categories()[1].name, 'Tops')
+
+        shoes.delete()
+        self.assertEqual(get_categories(), (self.category,))
+
+    def test_local_copy_expires(self):
+        get_categories()
+        # A change made by another process that shares no cache with this one
+        Category.objects.filter(pk=self.category.pk).update(name='Tops')
+        self.assertEqual(get_categories()[0].name, 'Shirts')
+        later = time.monotonic() + navigation.LOCAL_TTL
+        with mock.patch('products.navigation.time.monotonic', return_value=later):
+            self.assertEqual(get_categories()[0].name, 'Tops')
+
+    def test_pages_render_cached_navigation(self):
+        get_categories()
+        response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, 'Shirts')
+        self.assertEqual(response.context['categories'], (self.category,))
+
+
+class ProductCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(category=self.category, name='Linen Shirt',
+                                              slug='linen-shirt', price=Decimal('45.00'), stock=3)
+
+    def test_cards_are_cached_until_product_is_updated(self):
+        url = reverse('products:product_list')
+        self.assertContains(self.client.get(url), 'Linen Shirt')
+
+        # update() leaves Product.updated alone, so the cached card is served
+        Product.objects.filter(pk=self.product.pk).update(name='Cotton Shirt')
+        self.assertContains(self.client.get(url), 'Linen Shirt')
+
+        self.product.name = 'Cotton Shirt'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Cotton Shirt')
+        self.assertNotContains(response, 'Linen Shirt')
+
+    def test_cached_cards_get_the_visitors_csrf_token(self):
+        self.client.get(reverse('products:product_list'))
+        response = self.client.get(reverse('products:product_list'))
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+
+    def test_home_uses_cached_cards(self):
+        call_command('refresh_home_feed', stdout=StringIO())
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Linen Shirt')
+        self.assertIsNotNone(cache.get(card_cache_key(self.product, 'home')))
+
+
+class HomeFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shoes', slug='shoes')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sneaker = Product.objects.create(category=self.category, name='Sneaker',
+                                                  slug='sneaker', price=Decimal('80.00'),
+                                                  stock=0, is_preorder=True)
+            self.boot = Product.objects.create(category=self.category, name='Boot',
+                                               slug='boot', price=Decimal('120.00'), stock=4)
+
+    def test_feed_is_refreshed_when_products_change(self):
+        feed = get_home_feed()
+        self.assertEqual(feed['featured'], [self.boot, self.sneaker])
+        self.assertEqual(feed['new_arrivals'], [self.boot, self.sneaker])
+        self.assertEqual(feed['preorder'], [self.sneaker])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boot.available = False
+            self.boot.save()
+        self.assertEqual(get_home_feed()['featured'], [self.sneaker])
+
+    def test_anonymous_home_page_is_served_from_cache(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Pre-Order Picks')
+        with self.assertNumQueries(0):
+            cached = Client().get(reverse('home'))
+        self.assertEqual(cached.content, response.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=self.category, name='Sandal', slug='sandal',
+                                   price=Decimal('30.00'), stock=4)
+        self.assertContains(self.client.get(reverse('home')), 'Sandal')
+
+    def test_only_fields_the_home_page_shows_refresh_it(self):
+        self.client.get(reverse('home'))
+        key = page_cache_key()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.boot.stock = 3
+            self.boot.save()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(page_cache_key(), key)
+
+        # A price shown on a card drops the cached page but keeps the feed
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.boot.price = Decimal('99.00')
+            self.boot.save()
+        self.assertEqual(callbacks, [invalidate_home_page])
+        self.assertIsNone(cache.get(page_cache_key()))
+
+    def test_feed_is_refreshed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for product in (self.boot, self.sneaker):
+                product.available = False
+                product.save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_home_feed()['featured'], [])
+
+    def test_query_string_is_not_cached_for_other_visitors(self):
+        self.client.get(reverse('home'), {'q': 'injected text'})
+        self.assertIsNone(cache.get(page_cache_key()))
+        self.assertNotContains(Client().get(reverse('home')), 'injected text')
+
+    def test_home_page_is_not_cached_for_visitors_with_a_cart(self):
+        self.client.post(reverse('cart:cart_add', args=[self.boot.id]), {'quantity': 1})
+        self.client.get(reverse('home'))
+        self.assertIsNone(cache.get(page_cache_key()))
+
+    def test_refresh_command(self):
+        Product.objects.filter(pk=self.boot.pk).update(available=False)
+        call_command('refresh_home_feed', stdout=StringIO())
+        self.assertEqual(get_home_feed()['featured'], [self.sneaker])
+
+
+def make_jpeg(width=800, height=1000):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 80, 60)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class ProductImageVariantTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        cache.clear()
+        self.category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            category=self.category,
+            name='Linen Shirt',
+            slug='linen-shirt',
+            price=Decimal('45.00'),
+            stock=3,
+            image=SimpleUploadedFile('shirt.jpg', make_jpeg(), content_type='image/jpeg')
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_variants_are_generated_on_save(self):
+        manifest = Product.objects.get(pk=self.product.pk).image_variants
+        self.assertEqual(manifest['source'], self.product.image.name)
+        self.assertEqual(manifest['width'], 800)
+        self.assertEqual(manifest['widths'], [320, 640])
+        for width in (320, 640):
+            path = os.path.join(self.media_root, images.variant_name(self.product.image.name, width))
+            with Image.open(path) as variant:
+                self.assertEqual(variant.format, 'WEBP')
+                self.assertEqual(variant.size, (width, width * 1000 // 800))
+
+    def test_saving_without_image_change_does_not_regenerate(self):
+        with mock.patch.object(images, 'generate_variants') as generate:
+            self.product.price = Decimal('40.00')
+            self.product.save()
+        generate.assert_not_called()
+
+    def test_templates_emit_srcset(self):
+        expected = (f'srcset="/media/{images.variant_name(self.product.image.name, 320)} 320w, '
+                    f'/media/{images.variant_name(self.product.image.name, 640)} 640w, '
+                    f'{self.product.image.url} 800w"')
+        response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, expected)
+        self.assertContains(response, f'sizes="{images.SIZES["card"]}"')
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertContains(response, expected, count=2)
+        self.assertContains(response, f'sizes="{images.SIZES["detail"]}"')
+
+    def backfill(self, *args):
+        out = StringIO()
+        call_command('generate_image_variants', '--workers=1', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_backfill_generates_missing_variants_and_is_restartable(self):
+        Product.objects.filter(pk=self.product.pk).update(image_variants={})
+        variant = os.path.join(self.media_root, images.variant_name(self.product.image.name, 320))
+        os.remove(variant)
+
+        self.assertIn('1 generated, 0 unchanged, 0 up to date', self.backfill())
+        self.assertTrue(os.path.exists(variant))
+        manifest = Product.objects.get(pk=self.product.pk).image_variants
+        self.assertTrue(images.is_current(manifest, self.product.image.name))
+        self.assertEqual(manifest['widths'], [320, 640])
+
+        self.assertIn('0 generated, 0 unchanged, 1 up to date', self.backfill())
+
+    def test_backfill_checks_hash_when_only_mtime_changed(self):
+        source = os.path.join(self.media_root, self.product.image.name)
+        os.utime(source, (0, 0))
+        with mock.patch.object(images, 'render_variants') as render:
+            self.assertIn('0 generated, 1 unchanged', self.backfill())
+        render.assert_not_called()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_variants['mtime'], 0)
+
+    def test_replaced_and_deleted_images_lose_their_variants(self):
+        old_variants = [os.path.join(self.media_root, images.variant_name(self.product.image.name, width))
+                        for width in (320, 640)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.image = SimpleUploadedFile('coat.jpg', make_jpeg(), content_type='image/jpeg')
+            self.product.save()
+        self.assertFalse(any(os.path.exists(path) for path in old_variants))
+        new_variants = [os.path.join(self.media_root, images.variant_name(self.product.image.name, width))
+                        for width in (320, 640)]
+        self.assertTrue(all(os.path.exists(path) for path in new_variants))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=self.product.pk).delete()
+        self.assertFalse(any(os.path.exists(path) for path in new_variants))
+
+    def test_backfill_prunes_unused_variants(self):
+        used = os.path.join(self.media_root, images.variant_name(self.product.image.name, 320))
+        stale = os.path.join(self.media_root, images.variant_name('products/old/gone.jpg', 320))
+        os.makedirs(os.path.dirname(stale))
+        with open(stale, 'wb') as variant:
+            variant.write(b'stale')
+        os.utime(stale, (0, 0))
+
+        self.assertIn('1 unused variant files removed', self.backfill())
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(used))
+        self.assertIn('0 unused variant files removed', self.backfill())
+
+    def test_demo_images_from_source_dir(self):
+        source_dir = os.path.join(self.media_root, 'demo')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'a.jpg'), 'wb') as image:
+            image.write(make_jpeg(400, 500))
+        product = Product.objects.create(category=self.category, name='Plain Tee', slug='plain-tee',
+                                         price=Decimal('15.00'), stock=5)
+
+        with self.assertNumQueries(3):
+            call_command('add_demo_images', f'--source-dir={source_dir}', stdout=StringIO())
+
+        product.refresh_from_db()
+        self.assertEqual(os.path.basename(product.image.name), f'product_{product.id}.jpg')
+        self.assertTrue(os.path.exists(product.image.path))
+        # The existing image is left alone
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image, self.product.image)
@@ -1,63 +1,111 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from .models import Category, Product
+from .navigation import get_categories
+from . import facets, feed, search
+from .pagination import CachedCountPaginator, InvalidCursor, KeysetPaginator
 from cart.forms import CartAddProductForm
 
+PRODUCTS_PER_PAGE = 12
+
+# Every ordering ends with the primary key so ties have a stable position
+SORT_ORDERINGS = {
+    'name': ('name', 'id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'newest': ('-created', '-id'),
+}
+
 def home_view(request):
-    """View for the home page"""
-    products = Product.objects.filter(available=True)[:8]  # Get the first 8 available products
-    return render(request, 'home.html', {'products': products})
+    """View for the home page, served from the materialized feed"""
+    cacheable = feed.is_page_cacheable(request)
+    if cacheable:
+        cache_key = feed.page_cache_key()
+        content = cache.get(cache_key)
+        if content is not None:
+            return HttpResponse(content)
+    
+    sections = feed.get_home_feed()
+    response = render(request, 'home.html', {'products': sections['featured'],
+                                             'new_arrivals': sections['new_arrivals'],
+                                             'preorder_products': sections['preorder']})
+    if cacheable:
+        cache.set(cache_key, response.content, settings.HOME_PAGE_CACHE_TIMEOUT)
+    return response
 
 def product_list(request, category_slug=None):
     """View for listing products with search and category filtering"""
     category = None
-    categories = Category.objects.all()
+    categories = get_categories()
     products = Product.objects.filter(available=True)
     query = request.GET.get('q', '').strip()
     
     # Apply search query if provided
+    ranked = False
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        if search.is_enabled():
+            ranked = True
+            products = search.filter_products(products, query)
+        else:
+            products = products.filter(search.fallback_filter(query))
     
-    # Apply category filter if provided
+    # Apply the sidebar filters and count the facets of what is left
+    filters = facets.parse_filters(request.GET)
+    products = facets.apply_filters(products, filters)
     if category_slug:
         category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
+    product_facets = facets.get_facets(products, categories,
+                                       dict(filters, q=query.lower()), category)
     
-    # Get sort parameter
-    sort_by = request.GET.get('sort', 'name')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'newest':
-        products = products.order_by('-created')
-    else:  # Default sort by name
-        products = products.order_by('name')
+    # Apply category filter if provided
+    if category:
+        products = products.filter(category=category)
     
-    # Pagination
-    paginator = Paginator(products, 12)  # Show 12 products per page
-    page = request.GET.get('page')
+    # Get sort parameter, search results default to best match first
+    sort_by = request.GET.get('sort', 'relevance' if ranked else 'name')
+    if sort_by == 'relevance' and ranked:
+        products = search.order_by_rank(products, query)
+    else:
+        if sort_by not in SORT_ORDERINGS:
+            sort_by = 'name'
+        products = products.order_by(*SORT_ORDERINGS[sort_by])
     
-    try:
-        products = paginator.page(page)
-    except PageNotAnInteger:
-        # If page is not an integer, deliver first page
-        products = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range, deliver last page of results
-        products = paginator.page(paginator.num_pages)
+    # Cursor pagination is used when the request carries a cursor (an empty
+    # one means the first page); it has no page numbers but every page is
+    # as cheap as the first. Relevance ordering has no seekable key.
+    cursor = request.GET.get('cursor')
+    if cursor is not None and sort_by in SORT_ORDERINGS:
+        paginator = KeysetPaginator(products, SORT_ORDERINGS[sort_by], PRODUCTS_PER_PAGE)
+        try:
+            products = paginator.page(cursor)
+        except InvalidCursor:
+            products = paginator.page()
+    else:
+        paginator = CachedCountPaginator(products, PRODUCTS_PER_PAGE,
+                                         count_timeout=settings.PRODUCT_COUNT_CACHE_TIMEOUT)
+        page = request.GET.get('page')
+        
+        try:
+            products = paginator.page(page)
+        except PageNotAnInteger:
+            # If page is not an integer, deliver first page
+            products = paginator.page(1)
+        except EmptyPage:
+            # If page is out of range, deliver last page of results
+            products = paginator.page(paginator.num_pages)
     
     return render(request, 'products/product_list.html',
                  {'category': category,
-                  'categories': categories,
                   'products': products,
+                  'page_obj': products,
+                  'is_paginated': products.has_other_pages(),
+                  'is_cursor_page': isinstance(paginator, KeysetPaginator),
                   'query': query,
+                  'filters': filters,
+                  'facets': product_facets,
                   'sort_by': sort_by})
 
 def product_detail(request, id, slug):